@@ -0,0 +1,322 @@
+import os
+import sys
+import csv
+import json
+import argparse
+from datetime import datetime
+
+from ledger import UploadLedger
+
+# ========= 配置区 =========
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEDGER_DB = os.path.join(HERE, "upload_ledger.sqlite3")
+MANIFEST_JSONL = os.path.join(os.path.dirname(HERE), "manifest.jsonl")
+LOCAL_OUTPUT_DIR = r"F:\youtubeup\gcpup\output"   # 与 upload.py 一致，用于查找 meta.json
+STATE_FILE = os.path.join(HERE, "cms_export_state.json")  # 保存增量导出水位（--commit 后才移动）
+ROWS_PER_INSERT = 500      # 每条 INSERT 语句的行数
+OPERATOR = "gcpup"         # 写入 create_by / update_by
+# =========================
+
+# video 表的导入列（video_id 自增）
+COLUMNS = ["title", "url", "poster", "name", "path", "duration", "height", "width", "size",
+           "remark", "create_by", "create_time", "update_by", "update_time"]
+# 已存在的视频按 remark（asset_id=<id>）匹配：重新打包后播放列表文件名带新时间戳，url 会变，
+# 不能当作匹配键。匹配到的只更新这些列；标题在CMS里可能被编辑过，不覆盖
+MATCH_COLUMN = "remark"
+UPDATE_COLUMNS = ["url", "poster", "name", "path", "duration", "height", "width", "size", "update_by", "update_time"]
+STAGING_TABLE = "tmp_video_import"
+# video.size 是有符号 int
+INT_MAX = 2147483647
+# video.title 是 varchar(255)（按字符计）
+TITLE_MAX = 255
+
+
+def load_manifest(path):
+    """manifest.jsonl -> {asset_id: 最后一条 status=done 的记录}"""
+    items = {}
+    if not os.path.exists(path):
+        return items
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("status") == "done" and rec.get("asset_id"):
+                items[rec["asset_id"]] = rec
+    return items
+
+
+def load_meta(asset_id, manifest_rec, output_dir):
+    """读取资产的 meta.json：先找 manifest 中记录的目录，再找 output_dir/<asset_id>/"""
+    candidates = []
+    if manifest_rec and manifest_rec.get("output_dir"):
+        candidates.append(os.path.join(manifest_rec["output_dir"], "meta.json"))
+    candidates.append(os.path.join(output_dir, asset_id, "meta.json"))
+    for p in candidates:
+        try:
+            with open(p, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            continue
+    return {}
+
+
+def build_row(asset, manifest_rec, meta, now):
+    """台账资产 + manifest + meta.json -> video 表一行（dict），没有播放列表的资产返回None"""
+    if not asset["playlist"]:
+        return None
+    info = dict(manifest_rec or {})
+    info.update({k: v for k, v in meta.items() if v not in (None, "")})
+    asset_id = asset["asset_id"]
+    playlist_path, playlist_url = asset["playlist"]
+    return {
+        "title": (info.get("original_stem") or info.get("original_filename") or f"Video {asset_id}")[:TITLE_MAX],
+        "url": playlist_url,
+        "poster": asset["cover"][1] if asset["cover"] else "",
+        "name": info.get("original_filename") or "",
+        "path": playlist_path,
+        "duration": int(info.get("duration_sec") or 0),
+        "height": int(info.get("height") or 0),
+        "width": int(info.get("width") or 0),
+        "size": min(int(asset["total_bytes"]), INT_MAX),
+        "remark": f"asset_id={asset_id}",
+        "create_by": OPERATOR,
+        "create_time": now,
+        "update_by": OPERATOR,
+        "update_time": now,
+    }
+
+
+def collect_rows(ledger_db, manifest_path, output_dir, since, seen=()):
+    """
+    返回 (rows, watermark, watermark_ids, skipped)，skipped 为缺少播放列表的 asset_id 列表。
+    updated_at 只精确到秒，所以按 >= since 查询，再排除上次已在 since 这一秒导出过的资产（seen）。
+    水位只按导出的行计算；被跳过的资产重新上传播放列表后 updated_at 会更新，下次增量导出会再次取到。
+    """
+    manifest = load_manifest(manifest_path)
+    ledger = UploadLedger(ledger_db)
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    skipped = []
+    watermark = since
+    watermark_ids = set(seen)
+    try:
+        for asset in ledger.iter_completed_assets(since):
+            updated_at = asset["updated_at"] or ""
+            if updated_at == since and asset["asset_id"] in seen:
+                continue
+            rec = manifest.get(asset["asset_id"])
+            row = build_row(asset, rec, load_meta(asset["asset_id"], rec, output_dir), now)
+            if row is None:
+                skipped.append(asset["asset_id"])
+                continue
+            rows.append(row)
+            # 结果按 updated_at 升序
+            if updated_at != watermark:
+                watermark, watermark_ids = updated_at, set()
+            watermark_ids.add(asset["asset_id"])
+    finally:
+        ledger.close()
+    return rows, watermark, sorted(watermark_ids), skipped
+
+
+# ---------- SQL ----------
+def sql_literal(v):
+    if v is None:
+        return "NULL"
+    if isinstance(v, int):
+        return str(v)
+    s = str(v)
+    for a, b in (("\\", "\\\\"), ("'", "\\'"), ("\0", "\\0"), ("\n", "\\n"), ("\r", "\\r"), ("\x1a", "\\Z")):
+        s = s.replace(a, b)
+    return f"'{s}'"
+
+
+def _cols(cols, alias=None):
+    return ", ".join(f"{alias}.`{c}`" if alias else f"`{c}`" for c in cols)
+
+
+def merge_statements():
+    """把临时表中的行合并进 video：同一资产（remark = asset_id=<id>）已存在则更新，否则插入"""
+    sets = ", ".join(f"v.`{c}` = t.`{c}`" for c in UPDATE_COLUMNS)
+    key = MATCH_COLUMN
+    return [
+        f"UPDATE `video` v JOIN `{STAGING_TABLE}` t ON v.`{key}` = t.`{key}` SET {sets};",
+        f"INSERT INTO `video` ({_cols(COLUMNS)})\n"
+        f"SELECT {_cols(COLUMNS, 't')} FROM `{STAGING_TABLE}` t\n"
+        f"WHERE NOT EXISTS (SELECT 1 FROM `video` v WHERE v.`{key}` = t.`{key}`);",
+        f"DROP TEMPORARY TABLE `{STAGING_TABLE}`;",
+    ]
+
+
+def staging_statements():
+    # 临时表只在当前连接可见；不带主键、不带自增，一次性批量装入。
+    # 匹配列加前缀索引（asset_id=<40位hex> 不到64字符），video 表上建议也加同样的索引，见 sync-gcp-to-db.md
+    return [
+        f"DROP TEMPORARY TABLE IF EXISTS `{STAGING_TABLE}`;",
+        f"CREATE TEMPORARY TABLE `{STAGING_TABLE}` (INDEX (`{MATCH_COLUMN}`(64)))\n"
+        f"AS SELECT {_cols(COLUMNS)} FROM `video` LIMIT 0;",
+    ]
+
+
+def write_sql(rows, out_path, rows_per_insert=ROWS_PER_INSERT):
+    """多行 INSERT 装入临时表，再一次性合并进 video（整个文件一个事务）"""
+    with open(out_path, mode="w", encoding="utf-8", newline="\n") as f:
+        f.write(f"-- video 批量导入：{len(rows)} 行，生成于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write("SET NAMES utf8mb4;\n")
+        f.write("\n".join(staging_statements()) + "\n")
+        for i in range(0, len(rows), rows_per_insert):
+            batch = rows[i:i + rows_per_insert]
+            values = ",\n".join(
+                "(" + ", ".join(sql_literal(r[c]) for c in COLUMNS) + ")" for r in batch
+            )
+            f.write(f"INSERT INTO `{STAGING_TABLE}` ({_cols(COLUMNS)}) VALUES\n{values};\n")
+        f.write("START TRANSACTION;\n")
+        f.write("\n".join(merge_statements()) + "\n")
+        f.write("COMMIT;\n")
+
+
+def write_load_data(rows, out_path):
+    """
+    生成 LOAD DATA 用的 CSV 和配套 SQL（<out>.load.sql）。
+    执行：mysql --local-infile=1 <db> < <out>.load.sql
+    """
+    with open(out_path, mode="w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        for r in rows:
+            writer.writerow([r[c] for c in COLUMNS])
+    csv_path = os.path.abspath(out_path).replace("\\", "/")
+    sql_path = os.path.splitext(out_path)[0] + ".load.sql"
+    with open(sql_path, mode="w", encoding="utf-8", newline="\n") as f:
+        f.write("SET NAMES utf8mb4;\n")
+        f.write("\n".join(staging_statements()) + "\n")
+        f.write(
+            f"LOAD DATA LOCAL INFILE {sql_literal(csv_path)} INTO TABLE `{STAGING_TABLE}`\n"
+            "CHARACTER SET utf8mb4\n"
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY ''\n"
+            "LINES TERMINATED BY '\\n'\n"
+            f"({_cols(COLUMNS)});\n"
+        )
+        f.write("START TRANSACTION;\n")
+        f.write("\n".join(merge_statements()) + "\n")
+        f.write("COMMIT;\n")
+    return sql_path
+
+
+# ---------- 水位 ----------
+# 状态文件：
+#   watermark / asset_ids  已确认导入数据库的水位（--commit 时更新）
+#   pending                最近一次生成、尚未确认导入的批次
+#   skipped                最近一次因缺少播放列表而跳过的资产
+def load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_watermark(path):
+    """返回 (watermark, 水位这一秒已导出的 asset_id 列表)"""
+    state = load_state(path)
+    return state.get("watermark") or "", state.get("asset_ids") or []
+
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, mode="w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def save_pending(path, out, watermark, asset_ids, rows, skipped):
+    """记录刚生成的批次；水位不动，直到 --commit"""
+    state = load_state(path)
+    state["pending"] = {
+        "out": out,
+        "watermark": watermark,
+        "asset_ids": asset_ids,
+        "rows": rows,
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    state["skipped"] = skipped
+    save_state(path, state)
+
+
+def commit_pending(path):
+    """确认最近生成的批次已导入：把它的水位设为当前水位，返回该批次（没有则返回None）"""
+    state = load_state(path)
+    pending = state.pop("pending", None)
+    if not pending:
+        return None
+    state.update({
+        "watermark": pending["watermark"],
+        "asset_ids": pending["asset_ids"],
+        "exported_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": pending["rows"],
+    })
+    save_state(path, state)
+    return pending
+
+
+def main():
+    ap = argparse.ArgumentParser("Export uploaded assets into the CMS video table")
+    ap.add_argument("--format", choices=["sql", "csv"], default="sql",
+                    help="sql: 多行INSERT+合并的SQL文件；csv: LOAD DATA 用的CSV + .load.sql")
+    ap.add_argument("--out", default="", help="输出文件（默认 cms_video_<时间>.sql/.csv）")
+    ap.add_argument("--ledger", default=LEDGER_DB, help="上传台账（upload_ledger.sqlite3）")
+    ap.add_argument("--manifest", default=MANIFEST_JSONL, help="打包脚本生成的 manifest.jsonl")
+    ap.add_argument("--output-dir", default=LOCAL_OUTPUT_DIR, help="打包输出目录（查找 meta.json）")
+    ap.add_argument("--since", default=None, help="只导出台账中 updated_at >= 此时间的资产（覆盖保存的水位）")
+    ap.add_argument("--full", action="store_true", help="忽略水位，导出全部已完成的资产")
+    ap.add_argument("--no-advance", action="store_true", help="不记录待确认批次（试运行，之后不能 --commit）")
+    ap.add_argument("--commit", action="store_true",
+                    help="确认最近生成的文件已成功导入数据库，移动水位（不导出）")
+    args = ap.parse_args()
+
+    if args.commit:
+        pending = commit_pending(STATE_FILE)
+        if pending is None:
+            print("没有待确认的导出批次")
+            return 1
+        print(f"✅ 已确认 {pending['out']} ({pending['rows']} 行)，水位 -> {pending['watermark'] or '-'}")
+        return
+
+    seen = []
+    if args.full:
+        since = ""
+    elif args.since is not None:
+        since = args.since
+    else:
+        since, seen = load_watermark(STATE_FILE)
+
+    rows, watermark, watermark_ids, skipped = collect_rows(
+        args.ledger, args.manifest, args.output_dir, since, set(seen))
+    print(f"资产: {len(rows)} 行待导出, {len(skipped)} 个缺少播放列表已跳过 (水位 {since or '-'} -> {watermark or '-'})")
+    if skipped:
+        # 这些资产重新上传播放列表后会再次被增量导出；列表同时保存在状态文件的 skipped 中
+        print(f"   跳过: {', '.join(skipped[:10])}{' ...' if len(skipped) > 10 else ''}")
+    if not rows:
+        return
+
+    out = args.out or f"cms_video_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{args.format}"
+    if args.format == "sql":
+        write_sql(rows, out)
+        print(f"✅ 已生成: {out}")
+        print(f"   执行: mysql <db> < {out}")
+    else:
+        sql_path = write_load_data(rows, out)
+        print(f"✅ 已生成: {out}, {sql_path}")
+        print(f"   执行: mysql --local-infile=1 <db> < {sql_path}")
+
+    if not args.no_advance:
+        save_pending(STATE_FILE, out, watermark, watermark_ids, len(rows), skipped)
+        print(f"   导入成功后执行: python cms_export.py --commit  （确认前水位不动，下次导出会包含这些资产）")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import os
+import time
+
+# 只清理分片；播放列表、meta.json、封面和文本映射文件始终保留（体积小，CMS和本地服务还要用）
+EVICTABLE_SUFFIXES = (".ts",)
+
+
+def scan_assets(output_dir):
+    """
+    扫描输出目录，返回每个资产的使用情况列表：
+    (asset_id, last_used, total_bytes, evictable_bytes, evictable_count)。
+    last_used 取目录内文件 atime/mtime 的最大值（只做 scandir/stat，不读文件）。
+    """
+    out = []
+    with os.scandir(output_dir) as it:
+        for d in it:
+            if not d.is_dir():
+                continue
+            last_used = 0.0
+            total = evictable = count = 0
+            with os.scandir(d.path) as files:
+                for e in files:
+                    if not e.is_file():
+                        continue
+                    st = e.stat()
+                    total += st.st_size
+                    last_used = max(last_used, st.st_atime, st.st_mtime)
+                    if e.name.endswith(EVICTABLE_SUFFIXES):
+                        evictable += st.st_size
+                        count += 1
+            out.append((d.name, last_used, total, evictable, count))
+    return out
+
+
+def plan_evictions(assets, eligible, budget_bytes=0, max_age_sec=0, now=None):
+    """
+    选出要清理的资产，返回 [(asset_id, reason)]，按最近最少使用排序：
+    - 超过 max_age_sec 未使用的资产全部清理
+    - 其余按 LRU 顺序清理，直到输出目录总大小不超过 budget_bytes
+    只考虑 eligible（台账显示已全部上传完成）中还有分片的资产。
+    """
+    now = now or time.time()
+    total = sum(a[2] for a in assets)
+    plan = []
+    for asset_id, last_used, _, evictable, count in sorted(assets, key=lambda a: a[1]):
+        if asset_id not in eligible or count == 0:
+            continue
+        if max_age_sec > 0 and now - last_used > max_age_sec:
+            reason = "age"
+        elif budget_bytes > 0 and total > budget_bytes:
+            reason = "budget"
+        else:
+            continue
+        plan.append((asset_id, reason))
+        total -= evictable
+    return plan
+
+
+class Evictor:
+    """
+    校验后删除本地分片。
+
+    verify(asset_id, filenames) 返回远端已确认（大小+校验和一致）的文件名集合，
+    只有这些文件会被删除。删除按 batch_files 个一批进行，批与批之间暂停
+    batch_pause 秒，避免和正在进行的打包抢磁盘IO。
+    """
+
+    def __init__(self, output_dir, verify, batch_files=200, batch_pause=0.5, dry_run=False, log=print):
+        self.output_dir = output_dir
+        self.verify = verify
+        self.batch_files = max(1, batch_files)
+        self.batch_pause = batch_pause
+        self.dry_run = dry_run
+        self.log = log
+        self._in_batch = 0
+
+    def _throttle(self):
+        self._in_batch += 1
+        if self._in_batch >= self.batch_files:
+            self._in_batch = 0
+            if self.batch_pause > 0:
+                time.sleep(self.batch_pause)
+
+    def evict_asset(self, asset_id):
+        """返回 (deleted, freed_bytes, unverified)"""
+        asset_dir = os.path.join(self.output_dir, asset_id)
+        names = sorted(n for n in os.listdir(asset_dir) if n.endswith(EVICTABLE_SUFFIXES))
+        verified = self.verify(asset_id, names)
+        deleted = freed = 0
+        for name in names:
+            if name not in verified:
+                continue
+            path = os.path.join(asset_dir, name)
+            try:
+                size = os.path.getsize(path)
+                if not self.dry_run:
+                    os.remove(path)
+            except OSError as e:
+                self.log(f"   ⚠️  [{asset_id[:8]}] 删除失败 {name}: {e}")
+                continue
+            deleted += 1
+            freed += size
+            if not self.dry_run:
+                self._throttle()
+        return deleted, freed, len(names) - len(verified & set(names))
+
+    def run(self, plan):
+        """按计划逐个资产清理，返回汇总 dict"""
+        totals = {"assets": 0, "deleted": 0, "freed_bytes": 0, "unverified": 0}
+        for asset_id, reason in plan:
+            try:
+                deleted, freed, unverified = self.evict_asset(asset_id)
+            except Exception as e:
+                # 列表/校验失败：这个资产本次不清理
+                self.log(f"   ❌ [{asset_id[:8]}] 校验失败，跳过: {e}")
+                continue
+            totals["assets"] += 1
+            totals["deleted"] += deleted
+            totals["freed_bytes"] += freed
+            totals["unverified"] += unverified
+            self.log(f"   🧹 [{asset_id[:8]}] ({reason}) 删除 {deleted} 个分片, 释放 {freed / 1024 / 1024:.1f} MB"
+                     + (f", {unverified} 个未通过校验已保留" if unverified else ""))
+        return totals
@@ -0,0 +1,317 @@
+import os
+import csv
+import hashlib
+import sqlite3
+import threading
+import time
+
+CSV_HEADER = [
+    "asset_id",
+    "file_type",
+    "filename",
+    "status",
+    "local_path",
+    "gcs_path",
+    "gcs_url",
+    "size_mb",
+    "uploaded_at",
+    "error_message"
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    gcs_path      TEXT PRIMARY KEY,
+    asset_id      TEXT NOT NULL,
+    filename      TEXT NOT NULL,
+    file_type     TEXT,
+    local_path    TEXT,
+    size          INTEGER,
+    mtime_ns      INTEGER,
+    crc32c        TEXT,
+    status        TEXT NOT NULL,
+    gcs_url       TEXT,
+    uploaded_at   TEXT,
+    error_message TEXT,
+    updated_at    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_asset ON uploads(asset_id);
+CREATE TABLE IF NOT EXISTS assets (
+    asset_id     TEXT PRIMARY KEY,
+    fingerprint  TEXT NOT NULL,
+    complete     INTEGER NOT NULL,
+    file_count   INTEGER,
+    total_bytes  INTEGER,
+    updated_at   TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    gcs_path     TEXT PRIMARY KEY,
+    session_uri  TEXT NOT NULL,
+    size         INTEGER NOT NULL,
+    mtime_ns     INTEGER NOT NULL,
+    created_at   TEXT
+);
+"""
+
+_UPSERT = """
+INSERT INTO uploads (gcs_path, asset_id, filename, file_type, local_path, size, mtime_ns,
+                     crc32c, status, gcs_url, uploaded_at, error_message, updated_at)
+VALUES (:gcs_path, :asset_id, :filename, :file_type, :local_path, :size, :mtime_ns,
+        :crc32c, :status, :gcs_url, :uploaded_at, :error_message, :updated_at)
+ON CONFLICT(gcs_path) DO UPDATE SET
+    asset_id=excluded.asset_id, filename=excluded.filename, file_type=excluded.file_type,
+    local_path=excluded.local_path, size=excluded.size, mtime_ns=excluded.mtime_ns,
+    crc32c=COALESCE(excluded.crc32c, uploads.crc32c), status=excluded.status,
+    gcs_url=excluded.gcs_url,
+    uploaded_at=CASE WHEN excluded.status='SKIPPED' THEN uploads.uploaded_at ELSE excluded.uploaded_at END,
+    error_message=excluded.error_message, updated_at=excluded.updated_at
+"""
+
+# 这些状态表示远端已有正确的对象
+DONE_STATUSES = ("SUCCESS", "SKIPPED")
+
+
+def now_str():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def asset_fingerprint(asset_dir_path):
+    """
+    本地资产目录指纹：所有文件的 (文件名, 大小, mtime) 的sha1。
+    只做 scandir/stat，不读文件内容、不访问网络。
+    返回 (fingerprint, file_count, total_bytes)
+    """
+    entries = []
+    with os.scandir(asset_dir_path) as it:
+        for e in it:
+            if e.is_file():
+                st = e.stat()
+                entries.append(f"{e.name}|{st.st_size}|{st.st_mtime_ns}")
+    entries.sort()
+    total = sum(int(x.split("|")[1]) for x in entries)
+    return hashlib.sha1("\n".join(entries).encode("utf-8")).hexdigest(), len(entries), total
+
+
+class UploadLedger:
+    """
+    本地上传台账（SQLite），以 gcs_path 为主键记录大小、mtime、校验和和上传时间。
+
+    - 整个资产目录指纹未变且已完成 -> 直接跳过，不访问网络
+    - 单个文件大小/mtime与台账一致且状态为成功 -> 跳过
+    - 写入先进入内存缓冲，攒够 batch_size 行或超过 flush_interval 秒后一次事务提交
+    - 可以从台账重新生成 CSV 日志和 asset_summary
+    - 保存大文件的可续传上传会话URI，进程重启后可继续上传
+    """
+
+    def __init__(self, db_path, batch_size=200, flush_interval=2.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.time()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    # ---------- 查询 ----------
+    def is_asset_done(self, asset_id, fingerprint):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, complete FROM assets WHERE asset_id=?", (asset_id,)
+            ).fetchone()
+        return bool(row) and row[0] == fingerprint and bool(row[1])
+
+    def load_asset(self, asset_id):
+        """返回 {gcs_path: (size, mtime_ns, crc32c, status)}，一个资产一次查询"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT gcs_path, size, mtime_ns, crc32c, status FROM uploads WHERE asset_id=?",
+                (asset_id,)
+            ).fetchall()
+        return {r[0]: (r[1], r[2], r[3], r[4]) for r in rows}
+
+    def completed_asset_ids(self):
+        """上次处理时全部文件都已上传成功的资产"""
+        with self._lock:
+            rows = self._conn.execute("SELECT asset_id FROM assets WHERE complete=1").fetchall()
+        return {r[0] for r in rows}
+
+    @staticmethod
+    def file_done(entry, size, mtime_ns):
+        """台账记录表明该文件（同大小、同mtime）已在远端"""
+        return (
+            entry is not None
+            and entry[3] in DONE_STATUSES
+            and entry[0] == size
+            and entry[1] == mtime_ns
+        )
+
+    # ---------- 写入（批量） ----------
+    def record(self, asset_id, filename, file_type, local_path, gcs_path, status,
+               gcs_url="", uploaded_at="", error_message="", crc32c=None, size=None, mtime_ns=None):
+        if size is None or mtime_ns is None:
+            try:
+                st = os.stat(local_path)
+                size, mtime_ns = st.st_size, st.st_mtime_ns
+            except OSError:
+                pass
+        row = {
+            "gcs_path": gcs_path,
+            "asset_id": asset_id,
+            "filename": filename,
+            "file_type": file_type,
+            "local_path": local_path,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "crc32c": crc32c,
+            "status": status,
+            "gcs_url": gcs_url,
+            "uploaded_at": uploaded_at,
+            "error_message": error_message,
+            "updated_at": now_str(),
+        }
+        with self._lock:
+            self._pending.append(row)
+            if (len(self._pending) >= self.batch_size
+                    or time.time() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def mark_asset(self, asset_id, fingerprint, complete, changed=True):
+        """
+        记录资产处理结果。文件数和总大小取台账中已完成的文件，而不是本地目录：
+        本地分片被清理后目录只剩播放列表等小文件，但远端对象并没有变。
+        changed=False（本次没有上传任何文件、完成状态也没变）时保留原 updated_at，
+        避免增量导出重复导出未变化的资产。
+        """
+        with self._lock:
+            self._flush_locked()
+            file_count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads WHERE asset_id=? AND status IN (%s)"
+                % ",".join("?" * len(DONE_STATUSES)),
+                (asset_id,) + DONE_STATUSES
+            ).fetchone()
+            self._conn.execute(
+                "INSERT INTO assets (asset_id, fingerprint, complete, file_count, total_bytes, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(asset_id) DO UPDATE SET "
+                "fingerprint=excluded.fingerprint, complete=excluded.complete, "
+                "file_count=excluded.file_count, total_bytes=excluded.total_bytes, "
+                "updated_at=CASE WHEN ? OR assets.complete != excluded.complete "
+                "THEN excluded.updated_at ELSE assets.updated_at END",
+                (asset_id, fingerprint, 1 if complete else 0, file_count, total_bytes, now_str(),
+                 1 if changed else 0)
+            )
+            self._conn.commit()
+
+    # ---------- 可续传上传会话 ----------
+    def get_session(self, gcs_path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT session_uri, size, mtime_ns FROM sessions WHERE gcs_path=?", (gcs_path,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"uri": row[0], "size": row[1], "mtime_ns": row[2]}
+
+    def save_session(self, gcs_path, session_uri, size, mtime_ns):
+        # 会话URI立即提交，不走批量缓冲：进程崩溃后必须还能找到
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (gcs_path, session_uri, size, mtime_ns, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (gcs_path, session_uri, size, mtime_ns, now_str())
+            )
+
+    def drop_session(self, gcs_path):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE gcs_path=?", (gcs_path,))
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            with self._conn:
+                self._conn.executemany(_UPSERT, self._pending)
+            self._pending = []
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    # ---------- 导出 ----------
+    def iter_rows(self, statuses=None):
+        """
+        按 asset_id、文件名顺序遍历台账行（dict）。
+        逐行从游标读取，不一次性载入整个台账；用单独的只读连接（WAL下可与写入并发），
+        遍历期间不占用共享连接的锁。
+        """
+        self.flush()
+        sql = ("SELECT asset_id, file_type, filename, status, local_path, gcs_path, gcs_url, "
+               "size, uploaded_at, error_message, crc32c FROM uploads")
+        args = ()
+        if statuses:
+            sql += " WHERE status IN (%s)" % ",".join("?" * len(statuses))
+            args = tuple(statuses)
+        sql += " ORDER BY asset_id, filename"
+        keys = ["asset_id", "file_type", "filename", "status", "local_path", "gcs_path",
+                "gcs_url", "size", "uploaded_at", "error_message", "crc32c"]
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for r in conn.execute(sql, args):
+                yield dict(zip(keys, r))
+        finally:
+            conn.close()
+
+    def iter_completed_assets(self, since=None):
+        """
+        按 updated_at 顺序遍历已全部上传完成的资产（updated_at >= since），
+        返回 dict：asset_id, updated_at, total_bytes, playlist/cover 的 (gcs_path, gcs_url)。
+        资产有多个播放列表时取文件名最大（最新）的一个。
+        """
+        self.flush()
+        since = since or ""
+        with self._lock:
+            assets = self._conn.execute(
+                "SELECT asset_id, updated_at, total_bytes FROM assets "
+                "WHERE complete=1 AND updated_at >= ? ORDER BY updated_at, asset_id",
+                (since,)
+            ).fetchall()
+            files = self._conn.execute(
+                "SELECT u.asset_id, u.file_type, u.gcs_path, u.gcs_url FROM uploads u "
+                "JOIN assets a ON a.asset_id = u.asset_id "
+                "WHERE a.complete=1 AND a.updated_at >= ? AND u.file_type IN ('playlist', 'cover') "
+                "AND u.status IN (%s) ORDER BY u.filename" % ",".join("?" * len(DONE_STATUSES)),
+                (since,) + DONE_STATUSES
+            ).fetchall()
+        by_asset = {}
+        for asset_id, file_type, gcs_path, gcs_url in files:
+            by_asset.setdefault(asset_id, {})[file_type] = (gcs_path, gcs_url)
+        for asset_id, updated_at, total_bytes in assets:
+            f = by_asset.get(asset_id, {})
+            yield {
+                "asset_id": asset_id,
+                "updated_at": updated_at,
+                "total_bytes": total_bytes or 0,
+                "playlist": f.get("playlist"),
+                "cover": f.get("cover"),
+            }
+
+    def export_csv(self, csv_path):
+        """按原 upload_log_*.csv 格式重新生成日志"""
+        n = 0
+        with open(csv_path, mode="w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            for r in self.iter_rows():
+                size_mb = round((r["size"] or 0) / 1024 / 1024, 2)
+                writer.writerow([
+                    r["asset_id"], r["file_type"], r["filename"], r["status"], r["local_path"],
+                    r["gcs_path"], r["gcs_url"] or "", size_mb, r["uploaded_at"] or "",
+                    r["error_message"] or ""
+                ])
+                n += 1
+        return n
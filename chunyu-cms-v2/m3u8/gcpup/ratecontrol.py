@@ -0,0 +1,216 @@
+import random
+import threading
+import time
+from collections import deque
+
+# 可重试的HTTP状态码：超时、限流、服务端临时错误
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+THROTTLE_STATUS = {429, 503}
+
+
+def error_status(exc):
+    """从异常中取HTTP状态码（google.api_core 异常和 ResumableUploadError 都有 .code）"""
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc):
+    """网络异常（requests 的异常都是 OSError 子类）或可重试状态码"""
+    code = error_status(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return isinstance(exc, (OSError, TimeoutError))
+
+
+def is_throttle(exc):
+    return error_status(exc) in THROTTLE_STATUS
+
+
+def backoff_delay(attempt, base, cap):
+    """带完全抖动的指数退避：[0, min(cap, base * 2^attempt)] 内均匀随机"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    令牌桶带宽限制（字节/秒）。rate<=0 表示不限速。
+    大于桶容量的请求会分多次取令牌，平均速率仍然受限。
+    """
+
+    def __init__(self, rate_bytes_per_sec, burst_bytes=None):
+        self.rate = float(rate_bytes_per_sec)
+        self.capacity = float(burst_bytes or max(rate_bytes_per_sec, 1))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if self.rate <= 0:
+            return
+        remaining = float(nbytes)
+        while remaining > 0:
+            take = min(remaining, self.capacity)
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= take:
+                    self._tokens -= take
+                    remaining -= take
+                    wait = 0.0
+                else:
+                    wait = (take - self._tokens) / self.rate
+            if wait > 0:
+                time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    自适应并发上限（AIMD）：
+    - 遇到 429/503 限流：上限减半，并在一段时间内不再增加
+    - 其他错误（5xx、超时、连接断开）：最近 error_window 次请求中错误比例达到
+      error_threshold 时同样减半（至少先积累 error_min_samples 次结果）
+    - 连续成功 limit 次：上限 +1
+    - 每个观察周期比较吞吐量：上次加并发后吞吐没有提升 5% 以上，就退回一级
+    """
+
+    def __init__(self, min_limit, max_limit, initial=None, period=10.0,
+                 error_window=20, error_threshold=0.2, error_min_samples=10):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, initial or self.max_limit // 2 or 1))
+        self.period = period
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._successes = 0
+        self._cooldown_until = 0.0
+        self._period_start = time.monotonic()
+        self._period_bytes = 0
+        self._last_throughput = None
+        self._raised_last_period = False
+        # 最近的请求结果（True=出错），用于计算错误比例
+        self._outcomes = deque(maxlen=max(1, error_window))
+        self.error_threshold = error_threshold
+        self.error_min_samples = max(1, min(error_min_samples, error_window))
+        self.throttled = 0
+        self.errors = 0
+        self.error_backoffs = 0
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, nbytes):
+        with self._cond:
+            self._outcomes.append(False)
+            self._successes += 1
+            self._period_bytes += nbytes
+            now = time.monotonic()
+            if self._successes >= self.limit and now >= self._cooldown_until and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._raised_last_period = True
+                self._cond.notify_all()
+            self._check_period(now)
+
+    def on_error(self, throttled):
+        with self._cond:
+            self._successes = 0
+            self._outcomes.append(True)
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                self._decrease(now)
+                return
+            self.errors += 1
+            if (len(self._outcomes) >= self.error_min_samples and now >= self._cooldown_until
+                    and sum(self._outcomes) / len(self._outcomes) >= self.error_threshold):
+                self.error_backoffs += 1
+                self._decrease(now)
+
+    def _decrease(self, now):
+        # 乘性减小 + 冷却期；清空错误窗口，冷却后按新的并发重新统计
+        self.limit = max(self.min_limit, self.limit // 2)
+        self._cooldown_until = now + self.period
+        self._outcomes.clear()
+
+    def _check_period(self, now):
+        elapsed = now - self._period_start
+        if elapsed < self.period:
+            return
+        throughput = self._period_bytes / elapsed
+        if (self._raised_last_period and self._last_throughput
+                and throughput < self._last_throughput * 1.05 and self.limit > self.min_limit):
+            # 加并发没有带来收益（链路已饱和），退回
+            self.limit -= 1
+        self._last_throughput = throughput
+        self._raised_last_period = False
+        self._period_start = now
+        self._period_bytes = 0
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "error_backoffs": self.error_backoffs,
+                "error_rate": round(sum(self._outcomes) / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "throughput_mbps": round((self._last_throughput or 0) * 8 / 1e6, 2),
+            }
+
+
+class UploadScheduler:
+    """
+    上传调度：令牌桶限速 + 自适应并发 + 抖动指数退避重试。
+
+    run(nbytes, fn) 在拿到并发名额后执行 fn，失败时按可重试规则退避重试，
+    最终失败则抛出最后一次的异常。
+    """
+
+    def __init__(self, bandwidth_bytes_per_sec=0, min_workers=1, max_workers=8,
+                 adaptive=True, max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        self.bucket = TokenBucket(bandwidth_bytes_per_sec, burst_bytes=max(bandwidth_bytes_per_sec, 1))
+        self.limiter = AdaptiveLimiter(min_workers, max_workers, initial=None if adaptive else max_workers)
+        self.adaptive = adaptive
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def throttle(self, nbytes):
+        """按带宽限制等待（分块上传时每块调用一次）"""
+        self.bucket.consume(nbytes)
+
+    def run(self, nbytes, fn, prepaid=False):
+        """
+        prepaid=True 表示 fn 内部会自己按块调用 throttle()（例如可续传上传），
+        这里不再预先扣除令牌。
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                if not prepaid:
+                    self.throttle(nbytes)
+                result = fn()
+            except Exception as e:
+                self.limiter.release()
+                if self.adaptive:
+                    self.limiter.on_error(is_throttle(e))
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+                attempt += 1
+                continue
+            self.limiter.release()
+            if self.adaptive:
+                self.limiter.on_success(nbytes)
+            return result
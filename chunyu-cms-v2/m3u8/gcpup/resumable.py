@@ -0,0 +1,254 @@
+import os
+import math
+import json
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+# GCS要求分块大小是256KB的整数倍（最后一块除外）
+CHUNK_ALIGN = 256 * 1024
+# compose 一次最多32个源对象
+MAX_COMPOSE_SOURCES = 32
+# 分段临时对象的前缀（桶根目录下，和正式文件分开；建议配生命周期规则过期）
+COMPOSE_TMP_PREFIX = "_tmp/compose/"
+
+
+class ResumableUploadError(Exception):
+    """上传会话失败（非网络异常，例如服务端返回错误状态）；code 为HTTP状态码"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class SessionExpired(ResumableUploadError):
+    """会话已失效（404/410），需要重新创建"""
+
+
+def align_chunk_size(chunk_size):
+    """向下取整到256KB的整数倍（至少256KB）"""
+    return max(CHUNK_ALIGN, chunk_size // CHUNK_ALIGN * CHUNK_ALIGN)
+
+
+def _object_url(endpoint, bucket, name):
+    return f"{endpoint}/storage/v1/b/{quote(bucket, safe='')}/o/{quote(name, safe='')}"
+
+
+def _check(resp, what):
+    if resp.status_code in (404, 410):
+        raise SessionExpired(f"{what}: HTTP {resp.status_code}", resp.status_code)
+    if resp.status_code >= 400:
+        raise ResumableUploadError(f"{what}: HTTP {resp.status_code} {resp.text[:300]}", resp.status_code)
+
+
+def start_session(http, endpoint, bucket, name, size, metadata=None, timeout=60):
+    """创建可续传上传会话，返回会话URI（有效期约一周）"""
+    body = dict(metadata or {})
+    body["name"] = name
+    resp = http.post(
+        f"{endpoint}/upload/storage/v1/b/{quote(bucket, safe='')}/o",
+        params={"uploadType": "resumable"},
+        data=json.dumps(body),
+        headers={
+            "Content-Type": "application/json; charset=UTF-8",
+            "X-Upload-Content-Length": str(size),
+        },
+        timeout=timeout,
+    )
+    _check(resp, "create resumable session")
+    uri = resp.headers.get("Location")
+    if not uri:
+        raise ResumableUploadError("create resumable session: no Location header")
+    return uri
+
+
+def _next_offset(resp):
+    # 308 的 Range 头形如 "bytes=0-1048575"；没有 Range 表示服务端还没收到任何字节
+    rng = resp.headers.get("Range")
+    if not rng:
+        return 0
+    return int(rng.rsplit("-", 1)[1]) + 1
+
+
+def query_session(http, uri, size, timeout=60):
+    """
+    查询会话进度。返回 (offset, None) 表示还需从 offset 继续上传；
+    返回 (size, object_resource) 表示已上传完成。
+    """
+    resp = http.put(uri, data=b"", headers={"Content-Range": f"bytes */{size}"}, timeout=timeout)
+    if resp.status_code in (200, 201):
+        return size, resp.json()
+    if resp.status_code == 308:
+        return _next_offset(resp), None
+    _check(resp, "query resumable session")
+    raise ResumableUploadError(f"query resumable session: unexpected HTTP {resp.status_code}", resp.status_code)
+
+
+def upload_resumable(http, endpoint, bucket, name, local_path, chunk_size,
+                     store=None, metadata=None, timeout=600, before_chunk=None):
+    """
+    分块可续传上传。store（一般是上传台账）保存会话URI，进程重启后从服务端
+    已确认的字节处继续，而不是从0开始。返回服务端的对象资源（dict）。
+
+    store 需要提供 get_session(name) / save_session(name, uri, size, mtime_ns) / drop_session(name)。
+    before_chunk(nbytes) 在发送每一块之前调用（用于带宽限制）。
+    """
+    chunk_size = align_chunk_size(chunk_size)
+    st = os.stat(local_path)
+    size = st.st_size
+
+    uri = None
+    offset = 0
+    if store is not None:
+        saved = store.get_session(name)
+        if saved and saved["size"] == size and saved["mtime_ns"] == st.st_mtime_ns:
+            try:
+                offset, done = query_session(http, saved["uri"], size)
+                if done is not None:
+                    store.drop_session(name)
+                    return done
+                uri = saved["uri"]
+            except SessionExpired:
+                store.drop_session(name)
+    if uri is None:
+        uri = start_session(http, endpoint, bucket, name, size, metadata)
+        offset = 0
+        if store is not None:
+            store.save_session(name, uri, size, st.st_mtime_ns)
+
+    with open(local_path, "rb") as f:
+        while True:
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+            if chunk:
+                content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+            else:
+                content_range = f"bytes */{size}"
+            if before_chunk is not None and chunk:
+                before_chunk(len(chunk))
+            resp = http.put(uri, data=chunk, headers={"Content-Range": content_range}, timeout=timeout)
+            if resp.status_code in (200, 201):
+                if store is not None:
+                    store.drop_session(name)
+                return resp.json()
+            if resp.status_code == 308:
+                offset = _next_offset(resp)
+                continue
+            if resp.status_code in (404, 410) and store is not None:
+                store.drop_session(name)
+            _check(resp, f"upload chunk {content_range}")
+            raise ResumableUploadError(f"upload chunk {content_range}: unexpected HTTP {resp.status_code}",
+                                       resp.status_code)
+
+
+class _FileSlice:
+    """文件的一段 [offset, offset+length)，以流方式交给 requests（带 Content-Length）"""
+
+    def __init__(self, path, offset, length, block=1024 * 1024):
+        self._f = open(path, "rb")
+        self._f.seek(offset)
+        self._left = length
+        self._len = length
+        self._block = block
+
+    def __len__(self):
+        return self._len
+
+    def read(self, n=-1):
+        if self._left <= 0:
+            return b""
+        if n is None or n < 0 or n > self._left:
+            n = self._left
+        data = self._f.read(n)
+        self._left -= len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(self._block)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self._f.close()
+
+
+def _upload_part(http, endpoint, bucket, part_name, local_path, offset, length, timeout):
+    body = _FileSlice(local_path, offset, length)
+    try:
+        resp = http.post(
+            f"{endpoint}/upload/storage/v1/b/{quote(bucket, safe='')}/o",
+            params={"uploadType": "media", "name": part_name},
+            data=body,
+            headers={"Content-Type": "application/octet-stream", "Content-Length": str(length)},
+            timeout=timeout,
+        )
+    finally:
+        body.close()
+    _check(resp, f"upload part {part_name}")
+    return resp.json()
+
+
+def upload_composite(http, endpoint, bucket, name, local_path, parts,
+                     max_workers=4, metadata=None, timeout=600, run_part=None,
+                     part_prefix=COMPOSE_TMP_PREFIX):
+    """
+    并行分段上传：把文件切成 parts 段并行上传为临时对象
+    <part_prefix><name>.partNNofMM，然后在服务端 compose 成目标对象并删除临时对象。
+    注意：合成对象只有 crc32c，没有 md5。
+
+    临时对象放在单独的前缀下（默认 _tmp/compose/），不在 hls/ 目录里：
+    进程被杀、删除失败时残留的分段不会被列目录/补元数据/校验当成正式文件，
+    可以给这个前缀配一条生命周期规则自动过期。
+
+    run_part(nbytes, fn) 用来执行每个分段上传和最后的 compose 请求（一般是
+    UploadScheduler.run），这样分段也受带宽限制、自适应并发和退避重试约束；
+    不传则直接调用。
+    """
+    def _run(nbytes, fn):
+        return run_part(nbytes, fn) if run_part is not None else fn()
+
+    size = os.path.getsize(local_path)
+    parts = max(1, min(parts, MAX_COMPOSE_SOURCES))
+    part_size = max(CHUNK_ALIGN, math.ceil(size / parts))
+    ranges = []
+    offset = 0
+    while offset < size:
+        ranges.append((offset, min(part_size, size - offset)))
+        offset += part_size
+    part_names = [f"{part_prefix}{name}.part{i:02d}of{len(ranges):02d}" for i in range(len(ranges))]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ranges)))) as pool:
+            futures = [
+                pool.submit(_run, ln, functools.partial(
+                    _upload_part, http, endpoint, bucket, pn, local_path, off, ln, timeout))
+                for pn, (off, ln) in zip(part_names, ranges)
+            ]
+            for fut in futures:
+                fut.result()
+
+        destination = dict(metadata or {})
+
+        def _compose():
+            resp = http.post(
+                f"{_object_url(endpoint, bucket, name)}/compose",
+                data=json.dumps({
+                    "sourceObjects": [{"name": pn} for pn in part_names],
+                    "destination": destination,
+                }),
+                headers={"Content-Type": "application/json; charset=UTF-8"},
+                timeout=timeout,
+            )
+            _check(resp, f"compose {name}")
+            return resp.json()
+
+        return _run(0, _compose)
+    finally:
+        # 临时分段对象尽量清理，失败不影响结果
+        for pn in part_names:
+            try:
+                http.delete(_object_url(endpoint, bucket, pn), timeout=60)
+            except Exception:
+                pass
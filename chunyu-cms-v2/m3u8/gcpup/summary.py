@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import threading
+
+# 紧凑汇总文件格式：
+#   第1行 头部  {"format": "asset-summary/2", "url_prefix": "...", "base_dir": "hls"}
+#   之后每行一个资产（追加写入，同一 asset_id 以最后一行为准）
+#   {"asset_id": "...", "uploaded_at": "...", "playlist": ["playlist_x.m3u8", 0.01],
+#    "cover": ["cover.jpg", 0.05], "metadata": null,
+#    "segments": {"pattern": "seg_%05d.ts", "start": 0, "count": 312, "size_mb": [1.2, ...]},
+#    "other": [["source.txt", "text", 0.0]], "total_size_mb": 380.5, "file_count": 315}
+# gcs_path = base_dir/asset_id/filename，gcs_url = url_prefix/gcs_path，不再逐个文件重复保存
+FORMAT = "asset-summary/2"
+
+_NUMBERED_RE = re.compile(r"^(.*?)(\d+)(\.[^.]*)?$")
+
+
+def compact_segments(names, sizes):
+    """
+    分片名是连续编号（seg_00000.ts, seg_00001.ts, ...）时只保存命名模式、起始编号和数量；
+    否则保存完整文件名列表。
+    """
+    out = {"count": len(names), "size_mb": list(sizes)}
+    if not names:
+        out["names"] = []
+        return out
+    m = _NUMBERED_RE.match(names[0])
+    if m:
+        prefix, digits, suffix = m.group(1), m.group(2), m.group(3) or ""
+        width = len(digits)
+        start = int(digits)
+        pattern = f"{prefix.replace('%', '%%')}%0{width}d{suffix.replace('%', '%%')}"
+        if all(n == pattern % (start + i) for i, n in enumerate(names)):
+            out["pattern"] = pattern
+            out["start"] = start
+            return out
+    out["names"] = list(names)
+    return out
+
+
+def segment_names(seg):
+    if "pattern" in seg:
+        return [seg["pattern"] % (seg["start"] + i) for i in range(seg["count"])]
+    return list(seg["names"])
+
+
+def compact_record(asset_summary):
+    """旧格式的单个资产汇总 -> 紧凑记录"""
+    files = asset_summary["files"]
+
+    def _pair(entry):
+        return [entry["filename"], entry["size_mb"]] if entry else None
+
+    segments = sorted(files["segments"], key=lambda x: x["filename"])
+    return {
+        "asset_id": asset_summary["asset_id"],
+        "uploaded_at": asset_summary["uploaded_at"],
+        "playlist": _pair(files["playlist"]),
+        "cover": _pair(files["cover"]),
+        "metadata": _pair(files["metadata"]),
+        "segments": compact_segments([s["filename"] for s in segments], [s["size_mb"] for s in segments]),
+        "other": [[o["filename"], o["file_type"], o["size_mb"]] for o in files["other"]],
+        "total_size_mb": asset_summary["total_size_mb"],
+        "file_count": asset_summary["file_count"],
+    }
+
+
+def expand_record(rec, url_prefix, base_dir):
+    """紧凑记录 -> 旧格式的单个资产汇总（与原 asset_summary_*.json 中的结构一致）"""
+    asset_id = rec["asset_id"]
+
+    def _entry(filename, size_mb):
+        gcs_path = f"{base_dir}/{asset_id}/{filename}"
+        return {"filename": filename, "gcs_path": gcs_path, "gcs_url": f"{url_prefix}/{gcs_path}", "size_mb": size_mb}
+
+    def _single(pair):
+        return _entry(pair[0], pair[1]) if pair else None
+
+    seg = rec["segments"]
+    other = []
+    for filename, file_type, size_mb in rec["other"]:
+        e = _entry(filename, size_mb)
+        other.append({"filename": filename, "file_type": file_type, "gcs_path": e["gcs_path"],
+                      "gcs_url": e["gcs_url"], "size_mb": size_mb})
+    return {
+        "asset_id": asset_id,
+        "uploaded_at": rec["uploaded_at"],
+        "files": {
+            "playlist": _single(rec["playlist"]),
+            "segments": [_entry(n, s) for n, s in zip(segment_names(seg), seg["size_mb"])],
+            "cover": _single(rec["cover"]),
+            "metadata": _single(rec["metadata"]),
+            "other": other,
+        },
+        "total_size_mb": rec["total_size_mb"],
+        "file_count": rec["file_count"],
+    }
+
+
+class SummaryWriter:
+    """
+    追加写入的紧凑资产汇总（JSONL）。每完成一个资产写一行并 flush，
+    内存和写入量只和当前资产有关，不随目录总数增长。
+    """
+
+    def __init__(self, path, url_prefix, base_dir, truncate=False):
+        self.path = path
+        self._lock = threading.Lock()
+        fresh = truncate or not os.path.exists(path) or os.path.getsize(path) == 0
+        self._f = open(path, mode="w" if truncate else "a", encoding="utf-8")
+        if fresh:
+            self._write({"format": FORMAT, "url_prefix": url_prefix, "base_dir": base_dir})
+
+    def _write(self, obj):
+        self._f.write(json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._f.flush()
+
+    def append(self, asset_summary):
+        with self._lock:
+            self._write(compact_record(asset_summary))
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+
+def iter_records(path):
+    """遍历紧凑汇总文件，返回 (header, record) 迭代器；同一资产可能出现多次"""
+    header = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                # 进程被杀时最后一行可能不完整
+                continue
+            if "format" in obj:
+                header = obj
+                continue
+            if header is None:
+                raise ValueError(f"{path}: 缺少汇总文件头")
+            yield header, obj
+
+
+def load_summaries(path, asset_ids=None):
+    """
+    读取紧凑汇总并按需还原为旧格式 {asset_id: asset_summary}。
+    asset_ids 不为空时只还原这些资产。
+    """
+    latest = {}
+    for header, rec in iter_records(path):
+        if asset_ids is None or rec["asset_id"] in asset_ids:
+            latest[rec["asset_id"]] = (header, rec)
+    return {
+        asset_id: expand_record(rec, header["url_prefix"], header["base_dir"])
+        for asset_id, (header, rec) in latest.items()
+    }
+
+
+def export_legacy_json(jsonl_path, json_path):
+    """生成旧格式的 asset_summary_*.json（CMS 同步接口读取），返回资产数"""
+    summaries = load_summaries(jsonl_path)
+    tmp = json_path + ".tmp"
+    with open(tmp, mode="w", encoding="utf-8") as f:
+        json.dump(summaries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, json_path)
+    return len(summaries)
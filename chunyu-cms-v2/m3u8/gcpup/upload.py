@@ -1,9 +1,31 @@
 import os
+import sys
 import csv
-import json
-import time
+import argparse
+import base64
+import gzip
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+# 与打包脚本、本地播放服务共用的播放列表模块（../hls_playlist.py）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hls_playlist import MasterPlaylistError, Playlist
+
+from evict import Evictor, plan_evictions, scan_assets
+from ledger import CSV_HEADER, DONE_STATUSES, UploadLedger, asset_fingerprint
+from ratecontrol import TokenBucket, UploadScheduler
+from resumable import upload_composite, upload_resumable
+from summary import SummaryWriter, export_legacy_json
+
+try:
+    import google_crc32c  # google-cloud-storage 的依赖，一般已安装
+except ImportError:
+    google_crc32c = None
 
 # ========= 配置区 =========
 BUCKET_NAME = "qinshortvide"
@@ -12,17 +34,83 @@ GCS_BASE_DIR = "hls"  # GCS中的基础目录
 SERVICE_ACCOUNT_KEY = r"F:\youtubeup\gcpup\gcs-upload-sa.json"
 # GCS公共URL前缀（如果需要公开访问）
 GCS_PUBLIC_URL_PREFIX = f"https://storage.googleapis.com/{BUCKET_NAME}"
+# 并发配置
+MAX_WORKERS = 16        # 同时上传的文件总数（共享一个HTTP连接池）
+PER_ASSET_WORKERS = 8   # 单个资产目录内同时上传的文件数
+ASSET_WORKERS = 4       # 同时处理的资产目录数
+# 远端存在性检查
+LIST_WHOLE_PREFIX = False  # True: 启动时一次性列出整个 GCS_BASE_DIR；False: 每个资产列一次 hls/<asset_id>/
+VERIFY_CHECKSUM = True     # 大小一致时再比对 crc32c/md5，不一致则重新上传
+# 本地上传台账（SQLite），续传时不需要访问网络就能跳过已上传的文件/资产
+LEDGER_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_ledger.sqlite3")
+LOG_FLUSH_ROWS = 200       # CSV日志攒够多少行写一次
+# 大文件上传
+RESUMABLE_THRESHOLD_MB = 32   # 超过此大小使用分块可续传上传（会话URI保存在台账中，重启后续传）
+CHUNK_SIZE_MB = 8             # 分块大小（自动对齐到256KB的整数倍）
+COMPOSITE_THRESHOLD_MB = 0    # >0 时超过此大小的文件拆分并行上传、服务端合并（0=关闭）
+COMPOSITE_PARTS = 8           # 并行分段数（最多32）
+COMPOSITE_TMP_PREFIX = "_tmp/compose/"  # 分段临时对象前缀，不放在 GCS_BASE_DIR 下；可配生命周期规则自动删除
+# 限速与重试
+BANDWIDTH_LIMIT_MBPS = 0      # 上传带宽上限（Mbit/s），0=不限速；办公室共享上行时建议设置
+MAX_RETRIES = 5               # 网络错误/429/5xx 最多重试次数（抖动指数退避）
+BACKOFF_BASE_SEC = 1.0        # 退避基数：第n次重试最多等待 BACKOFF_BASE_SEC * 2^n 秒
+BACKOFF_MAX_SEC = 60.0        # 单次退避最长等待
+ADAPTIVE_CONCURRENCY = True   # 根据吞吐和限流信号自动调整并发（上限 MAX_WORKERS）
+MIN_WORKERS = 2               # 自适应并发的下限
+# 对象元数据（CDN缓存）：分片/封面文件名不会复用，长期缓存；播放列表短TTL
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PLAYLIST_CACHE_CONTROL = "public, max-age=60"
+METADATA_CACHE_CONTROL = "public, max-age=300"
+GZIP_PLAYLISTS = False     # True: 播放列表 gzip 压缩后上传（Content-Encoding: gzip，不支持gzip的客户端由GCS自动解压）
+# 本地清理：远端大小和校验和都确认一致后删除本地分片（播放列表、meta.json、封面保留）
+EVICT_AFTER_UPLOAD = False    # 上传结束后自动清理；也可以单独运行 --evict
+DISK_BUDGET_GB = 0            # 输出目录总大小上限，超出后按最近最少使用顺序清理；0=不按容量
+EVICT_MAX_AGE_DAYS = 0        # 超过N天未访问的资产直接清理；0=不按时间
+EVICT_BATCH_FILES = 200       # 每删除多少个文件暂停一次
+EVICT_BATCH_PAUSE_SEC = 0.5   # 暂停时长，避免和正在打包的任务抢磁盘IO
+EVICT_READ_MB_PER_SEC = 100   # 校验时读取本地文件的速率上限（MB/s），0=不限
+# 资产汇总：每完成一个资产向 JSONL 追加一行紧凑记录；结束时按需导出旧格式JSON（CMS同步接口读取）
+WRITE_LEGACY_SUMMARY = True
+# GCS JSON API 地址；本地测试可指向 fake-gcs-server 模拟器，例如 "http://localhost:4443"（匿名访问）
+GCS_API_ENDPOINT = "https://storage.googleapis.com"
 # =========================
 
 LOG_FILE = f"upload_log_{datetime.now().strftime('%Y-%m-%d')}.csv"
 ASSET_SUMMARY_FILE = f"asset_summary_{datetime.now().strftime('%Y-%m-%d')}.json"
+ASSET_SUMMARY_JSONL = f"asset_summary_{datetime.now().strftime('%Y-%m-%d')}.jsonl"
+
+# 多线程下保护CSV日志和控制台输出
+_log_lock = threading.Lock()
+_print_lock = threading.Lock()
+_log_buffer = []
+_ledger = None  # upload_all_assets 中初始化
+_scheduler = None  # upload_all_assets 中初始化
 
 
 def init_gcs_client():
-    """初始化GCS客户端"""
-    return storage.Client.from_service_account_json(
-        SERVICE_ACCOUNT_KEY
-    )
+    """初始化GCS客户端（所有线程共享一个客户端和连接池）"""
+    if GCS_API_ENDPOINT.rstrip("/") != "https://storage.googleapis.com":
+        # 本地模拟器：匿名凭证
+        client = storage.Client(
+            project="local-emulator",
+            credentials=AnonymousCredentials(),
+            client_options={"api_endpoint": GCS_API_ENDPOINT},
+        )
+    else:
+        client = storage.Client.from_service_account_json(
+            SERVICE_ACCOUNT_KEY
+        )
+    # 默认连接池只有10个连接，扩大到并发数，避免线程排队等连接
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS)
+    client._http.mount("https://", adapter)
+    client._http.mount("http://", adapter)
+    return client
+
+
+def tprint(*args, **kwargs):
+    """线程安全的print"""
+    with _print_lock:
+        print(*args, **kwargs)
 
 
 def init_log():
@@ -30,26 +118,14 @@ def init_log():
     if not os.path.exists(LOG_FILE):
         with open(LOG_FILE, mode="w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
-            writer.writerow([
-                "asset_id",
-                "file_type",
-                "filename",
-                "status",
-                "local_path",
-                "gcs_path",
-                "gcs_url",
-                "size_mb",
-                "uploaded_at",
-                "error_message"
-            ])
+            writer.writerow(CSV_HEADER)
 
 
 def log_row(asset_id, file_type, filename, status, local_path, gcs_path, 
             gcs_url, size_mb, uploaded_at="", error_message=""):
-    """记录日志行"""
-    with open(LOG_FILE, mode="a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
+    """记录日志行（先进缓冲区，攒够 LOG_FLUSH_ROWS 行再写文件）"""
+    with _log_lock:
+        _log_buffer.append([
             asset_id,
             file_type,
             filename,
@@ -61,12 +137,28 @@ def log_row(asset_id, file_type, filename, status, local_path, gcs_path,
             uploaded_at,
             error_message
         ])
+        if len(_log_buffer) >= LOG_FLUSH_ROWS:
+            _flush_log_locked()
+
+
+def flush_log():
+    """把缓冲的日志行写入CSV"""
+    with _log_lock:
+        _flush_log_locked()
+
+
+def _flush_log_locked():
+    if not _log_buffer:
+        return
+    with open(LOG_FILE, mode="a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(_log_buffer)
+    _log_buffer.clear()
 
 
-def save_asset_summary(asset_summaries):
-    """保存资产汇总信息到JSON文件，方便API调用"""
-    with open(ASSET_SUMMARY_FILE, mode="w", encoding="utf-8") as f:
-        json.dump(asset_summaries, f, ensure_ascii=False, indent=2)
+def export_asset_summary():
+    """从紧凑汇总（JSONL）生成旧格式的 asset_summary JSON，方便API调用"""
+    n = export_legacy_json(ASSET_SUMMARY_JSONL, ASSET_SUMMARY_FILE)
+    print(f"   已导出旧格式汇总: {ASSET_SUMMARY_FILE} ({n} 个资产)")
 
 
 def get_file_type(filename):
@@ -87,24 +179,275 @@ def get_file_type(filename):
         return 'other'
 
 
-def upload_file(client, bucket, asset_id, local_path, gcs_path):
-    """上传单个文件到GCS"""
+_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".json": "application/json",
+    ".txt": "text/plain; charset=utf-8",
+    ".key": "application/octet-stream",
+}
+
+
+def object_metadata(filename):
+    """
+    按文件类型返回上传时设置的 (content_type, cache_control, content_encoding)。
+    密钥文件不允许任何缓存；content_encoding 为 "gzip" 时上传前压缩。
+    """
+    file_type = get_file_type(filename)
+    content_type = _CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+    if file_type in ("segment", "cover"):
+        return content_type, IMMUTABLE_CACHE_CONTROL, None
+    if file_type == "playlist":
+        return content_type, PLAYLIST_CACHE_CONTROL, "gzip" if GZIP_PLAYLISTS else None
+    if file_type == "metadata":
+        return content_type, METADATA_CACHE_CONTROL, None
+    if file_type == "key":
+        return content_type, "private, no-store", None
+    return content_type, "private, max-age=0", None
+
+
+def gzip_payload(local_path):
+    # mtime=0：同一内容压缩结果固定，远端比对校验和才有意义
+    with open(local_path, "rb") as f:
+        return gzip.compress(f.read(), compresslevel=9, mtime=0)
+
+
+def list_remote_objects(client, prefix):
+    """
+    按前缀列出GCS对象（迭代器自动分页），
+    返回 {gcs_path: (size, crc32c, md5_hash, content_type, cache_control, content_encoding)}。
+    一次列表请求最多返回1000个对象，代替每个文件一次 HEAD。
+    """
+    def _list():
+        remote = {}
+        blobs = client.list_blobs(
+            BUCKET_NAME, prefix=prefix,
+            fields="items(name,size,crc32c,md5Hash,contentType,cacheControl,contentEncoding),nextPageToken"
+        )
+        for blob in blobs:
+            remote[blob.name] = (blob.size, blob.crc32c, blob.md5_hash,
+                                 blob.content_type, blob.cache_control, blob.content_encoding)
+        return remote
+
+    if _scheduler is None:
+        return _list()
+    return _scheduler.run(0, _list)
+
+
+def _file_checksum_b64(local_path, algo, data=None):
+    """计算本地文件（或 data）的校验和，格式与GCS一致（base64）"""
+    if algo == "crc32c":
+        h = google_crc32c.Checksum()
+    else:
+        h = hashlib.md5()
+    if data is not None:
+        h.update(data)
+    else:
+        with open(local_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    return base64.b64encode(h.digest()).decode("ascii")
+
+
+def remote_matches(local_path, remote_entry, data=None):
+    """
+    远端对象与本地文件大小一致且（可选）校验和一致时返回True。
+    data 不为空时（例如gzip压缩后的播放列表）与 data 比较。
+    """
+    size, crc32c, md5_hash = remote_entry[:3]
+    local_size = len(data) if data is not None else os.path.getsize(local_path)
+    if size is None or int(size) != local_size:
+        return False
+    if not VERIFY_CHECKSUM:
+        return True
+    if crc32c and google_crc32c is not None:
+        return _file_checksum_b64(local_path, "crc32c", data) == crc32c
+    if md5_hash:
+        return _file_checksum_b64(local_path, "md5", data) == md5_hash
+    return True
+
+
+def metadata_matches(remote_entry, meta):
+    """远端对象的 Content-Type / Cache-Control / Content-Encoding 是否已是期望值"""
+    if len(remote_entry) < 6:
+        return True
+    return tuple(remote_entry[3:6]) == tuple(meta)
+
+
+def patch_metadata(blob, meta):
+    """只修改对象元数据（不重新上传内容）"""
+    content_type, cache_control, _ = meta
+    blob.content_type = content_type
+    blob.cache_control = cache_control
+    if _scheduler is None:
+        blob.patch()
+    else:
+        _scheduler.run(0, blob.patch)
+
+
+def upload_file(client, bucket, asset_id, local_path, gcs_path, remote=None):
+    """
+    上传单个文件到GCS，返回 (status, result, crc32c)。
+    remote 为 list_remote_objects 的结果时直接查表判断是否已存在（不发请求），
+    远端大小或校验和不一致（例如上次上传被截断）则重新上传覆盖。
+    """
     blob = bucket.blob(gcs_path)
-    
+    meta = object_metadata(os.path.basename(local_path))
+    content_type, cache_control, content_encoding = meta
+    data = gzip_payload(local_path) if content_encoding == "gzip" else None
+
     # 检查文件是否已存在
-    if blob.exists():
-        return "SKIPPED", None
-    
+    if remote is not None:
+        entry = remote.get(gcs_path)
+        if entry is not None and remote_matches(local_path, entry, data):
+            if not metadata_matches(entry, meta):
+                try:
+                    patch_metadata(blob, meta)
+                except Exception as e:
+                    return "FAILED", f"更新对象元数据失败: {e}", None
+            return "SKIPPED", None, entry[1]
+    elif blob.exists():
+        return "SKIPPED", None, None
+
+    blob.content_type = content_type
+    blob.cache_control = cache_control
+    blob.content_encoding = content_encoding
+    api_metadata = {"contentType": content_type, "cacheControl": cache_control}
+    size = len(data) if data is not None else os.path.getsize(local_path)
+    endpoint = GCS_API_ENDPOINT.rstrip("/")
+    throttle = _scheduler.throttle if _scheduler is not None else None
+    composite = data is None and COMPOSITE_THRESHOLD_MB > 0 and size >= COMPOSITE_THRESHOLD_MB * 1024 * 1024
+
+    def _do_upload():
+        if data is not None:
+            blob.upload_from_string(data, content_type=content_type, timeout=600)
+            return blob.crc32c
+        if composite:
+            # 每个分段单独走调度器（限速、并发名额、退避重试）
+            obj = upload_composite(
+                client._http, endpoint, BUCKET_NAME, gcs_path, local_path,
+                parts=COMPOSITE_PARTS, max_workers=COMPOSITE_PARTS, metadata=api_metadata,
+                run_part=_scheduler.run if _scheduler is not None else None,
+                part_prefix=COMPOSITE_TMP_PREFIX
+            )
+            return obj.get("crc32c")
+        if size >= RESUMABLE_THRESHOLD_MB * 1024 * 1024:
+            # 每块单独限速；失败重试时从会话已确认的位置继续
+            obj = upload_resumable(
+                client._http, endpoint, BUCKET_NAME, gcs_path, local_path,
+                chunk_size=CHUNK_SIZE_MB * 1024 * 1024, store=_ledger, before_chunk=throttle,
+                metadata=api_metadata
+            )
+            return obj.get("crc32c")
+        blob.upload_from_filename(local_path, content_type=content_type, timeout=600)
+        return blob.crc32c
+
     try:
-        blob.upload_from_filename(local_path, timeout=600)
+        if _scheduler is None or composite:
+            # 分段合并上传不再占外层名额：分段各自排队，外层也占名额的话并发降到 1 时会死锁
+            crc32c = _do_upload()
+        else:
+            chunked = data is None and size >= RESUMABLE_THRESHOLD_MB * 1024 * 1024
+            crc32c = _scheduler.run(size, _do_upload, prepaid=chunked)
         gcs_url = f"{GCS_PUBLIC_URL_PREFIX}/{gcs_path}"
-        return "SUCCESS", gcs_url
+        return "SUCCESS", gcs_url, crc32c
     except Exception as e:
-        return "FAILED", str(e)
+        return "FAILED", str(e), None
+
+
+def upload_one(client, bucket, asset_id, asset_dir_path, filename, remote=None):
+    """上传资产目录中的单个文件并记录日志，返回结果字典（在线程池中执行）"""
+    local_path = os.path.join(asset_dir_path, filename)
+    file_type = get_file_type(filename)
+    size_mb = round(os.path.getsize(local_path) / 1024 / 1024, 2)
+    gcs_path = f"{GCS_BASE_DIR}/{asset_id}/{filename}"
+
+    status, result, crc32c = upload_file(client, bucket, asset_id, local_path, gcs_path, remote)
+    return finish_upload(asset_id, filename, file_type, local_path, gcs_path, size_mb, status, result, crc32c)
+
+
+def finish_upload(asset_id, filename, file_type, local_path, gcs_path, size_mb, status, result, crc32c=None):
+    """记录单个文件的上传结果到CSV日志和台账，返回结果字典"""
+    if status == "FAILED":
+        gcs_url = ""
+    elif status == "SUCCESS":
+        gcs_url = result
+    else:
+        gcs_url = f"{GCS_PUBLIC_URL_PREFIX}/{gcs_path}"
+
+    uploaded_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if status == "SUCCESS" else ""
+    error_message = result if status == "FAILED" else ""
+    log_row(
+        asset_id=asset_id,
+        file_type=file_type,
+        filename=filename,
+        status=status,
+        local_path=local_path,
+        gcs_path=gcs_path,
+        gcs_url=gcs_url,
+        size_mb=size_mb,
+        uploaded_at=uploaded_at,
+        error_message=error_message
+    )
+    if _ledger is not None:
+        _ledger.record(
+            asset_id, filename, file_type, local_path, gcs_path, status,
+            gcs_url=gcs_url, uploaded_at=uploaded_at, error_message=error_message, crc32c=crc32c
+        )
+    return {
+        "filename": filename,
+        "file_type": file_type,
+        "status": status,
+        "gcs_path": gcs_path,
+        "gcs_url": gcs_url,
+        "size_mb": size_mb,
+        "error_message": result if status == "FAILED" else "",
+    }
+
+
+def add_to_summary(asset_summary, res):
+    """把一个上传成功的文件记入资产汇总"""
+    file_type = res["file_type"]
+    entry = {
+        "filename": res["filename"],
+        "gcs_path": res["gcs_path"],
+        "gcs_url": res["gcs_url"],
+        "size_mb": res["size_mb"]
+    }
+    asset_summary["total_size_mb"] += res["size_mb"]
+    asset_summary["file_count"] += 1
+
+    if file_type == 'playlist':
+        asset_summary["files"]["playlist"] = entry
+    elif file_type == 'segment':
+        asset_summary["files"]["segments"].append(entry)
+    elif file_type == 'cover':
+        asset_summary["files"]["cover"] = entry
+    elif file_type == 'metadata':
+        asset_summary["files"]["metadata"] = entry
+    else:
+        entry = {
+            "filename": res["filename"],
+            "file_type": file_type,
+            "gcs_path": res["gcs_path"],
+            "gcs_url": res["gcs_url"],
+            "size_mb": res["size_mb"]
+        }
+        asset_summary["files"]["other"].append(entry)
 
 
-def upload_asset_directory(client, bucket, asset_dir_path, asset_id):
-    """上传单个资产目录的所有文件"""
+def upload_asset_directory(client, bucket, asset_dir_path, asset_id, pool, remote=None):
+    """
+    上传单个资产目录的所有文件。
+
+    除播放列表外的文件提交到共享线程池并发上传（单资产并发数受 PER_ASSET_WORKERS 限制）；
+    播放列表最后上传，且只有在所有分片都成功（或已存在）后才上传，
+    避免播放器拿到引用了缺失分片的m3u8。
+
+    remote 为整个前缀的远端对象表；为None时先列出本资产前缀。
+    """
     asset_summary = {
         "asset_id": asset_id,
         "uploaded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -118,124 +461,143 @@ def upload_asset_directory(client, bucket, asset_dir_path, asset_id):
         "total_size_mb": 0,
         "file_count": 0
     }
-    
-    files = os.listdir(asset_dir_path)
+
+    files = sorted(f for f in os.listdir(asset_dir_path)
+                   if not os.path.isdir(os.path.join(asset_dir_path, f)))
+    playlists = [f for f in files if f.endswith('.m3u8')]
+    others = [f for f in files if not f.endswith('.m3u8')]
     total_files = len(files)
-    uploaded_count = 0
-    skipped_count = 0
-    failed_count = 0
-    
-    print(f"\n📁 处理资产目录: {asset_id}")
-    print(f"   文件总数: {total_files}")
-    
-    # 先上传m3u8文件，然后是其他文件
-    sorted_files = sorted(files, key=lambda x: (
-        0 if x.endswith('.m3u8') else 1,
-        x
-    ))
-    
-    for filename in sorted_files:
+    counts = {"SUCCESS": 0, "SKIPPED": 0, "FAILED": 0}
+
+    tprint(f"\n📁 处理资产目录: {asset_id}  (文件总数: {total_files})")
+
+    # 台账：目录指纹未变且上次已全部完成 -> 整个资产跳过（不访问网络）
+    fingerprint, _, _ = asset_fingerprint(asset_dir_path)
+    if _ledger is not None and _ledger.is_asset_done(asset_id, fingerprint):
+        tprint(f"   ⏭  [{asset_id[:8]}] 台账显示已全部上传，跳过")
+        return asset_summary
+    done_map = _ledger.load_asset(asset_id) if _ledger is not None else {}
+
+    def _ledger_done(filename):
+        st = os.stat(os.path.join(asset_dir_path, filename))
+        return UploadLedger.file_done(
+            done_map.get(f"{GCS_BASE_DIR}/{asset_id}/{filename}"), st.st_size, st.st_mtime_ns
+        )
+
+    def _skip_by_ledger(filename):
         local_path = os.path.join(asset_dir_path, filename)
-        
-        # 跳过目录
-        if os.path.isdir(local_path):
-            continue
-        
-        file_type = get_file_type(filename)
-        size_mb = round(os.path.getsize(local_path) / 1024 / 1024, 2)
         gcs_path = f"{GCS_BASE_DIR}/{asset_id}/{filename}"
-        
-        # 上传文件
-        status, result = upload_file(client, bucket, asset_id, local_path, gcs_path)
-        
-        if status == "SUCCESS":
-            gcs_url = result
-            uploaded_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            uploaded_count += 1
-            asset_summary["total_size_mb"] += size_mb
-            asset_summary["file_count"] += 1
-            
-            # 记录到汇总信息
-            if file_type == 'playlist':
-                asset_summary["files"]["playlist"] = {
-                    "filename": filename,
-                    "gcs_path": gcs_path,
-                    "gcs_url": gcs_url,
-                    "size_mb": size_mb
-                }
-            elif file_type == 'segment':
-                asset_summary["files"]["segments"].append({
-                    "filename": filename,
-                    "gcs_path": gcs_path,
-                    "gcs_url": gcs_url,
-                    "size_mb": size_mb
-                })
-            elif file_type == 'cover':
-                asset_summary["files"]["cover"] = {
-                    "filename": filename,
-                    "gcs_path": gcs_path,
-                    "gcs_url": gcs_url,
-                    "size_mb": size_mb
-                }
-            elif file_type == 'metadata':
-                asset_summary["files"]["metadata"] = {
-                    "filename": filename,
-                    "gcs_path": gcs_path,
-                    "gcs_url": gcs_url,
-                    "size_mb": size_mb
-                }
-            else:
-                asset_summary["files"]["other"].append({
-                    "filename": filename,
-                    "file_type": file_type,
-                    "gcs_path": gcs_path,
-                    "gcs_url": gcs_url,
-                    "size_mb": size_mb
-                })
-            
-            print(f"   ✅ [{uploaded_count}/{total_files}] {filename} ({size_mb} MB)")
-            
-        elif status == "SKIPPED":
-            skipped_count += 1
-            gcs_url = f"{GCS_PUBLIC_URL_PREFIX}/{gcs_path}"
-            print(f"   ⏭  [{skipped_count} 跳过] {filename}")
-        else:
-            failed_count += 1
-            error_message = result
-            gcs_url = ""
-            print(f"   ❌ [{failed_count} 失败] {filename}: {error_message}")
-            time.sleep(2)  # 失败后等待
-        
-        # 记录日志
-        log_row(
-            asset_id=asset_id,
-            file_type=file_type,
-            filename=filename,
-            status=status,
-            local_path=local_path,
-            gcs_path=gcs_path,
-            gcs_url=gcs_url if status != "FAILED" else "",
-            size_mb=size_mb,
-            uploaded_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S") if status == "SUCCESS" else "",
-            error_message=result if status == "FAILED" else ""
+        return finish_upload(
+            asset_id, filename, get_file_type(filename), local_path, gcs_path,
+            round(os.path.getsize(local_path) / 1024 / 1024, 2), "SKIPPED", None,
+            done_map[gcs_path][2]
         )
-    
+
+    ledger_done = {f for f in files if _ledger_done(f)}
+
+    if remote is None and len(ledger_done) < len(files):
+        try:
+            remote = list_remote_objects(client, f"{GCS_BASE_DIR}/{asset_id}/")
+        except Exception as e:
+            # 列表失败时退回逐个 exists() 检查
+            tprint(f"   ⚠️  [{asset_id[:8]}] 列出远端对象失败，改为逐个检查: {e}")
+            remote = None
+
+    def _report(res):
+        counts[res["status"]] += 1
+        if res["status"] == "SUCCESS":
+            add_to_summary(asset_summary, res)
+            tprint(f"   ✅ [{asset_id[:8]}] {res['filename']} ({res['size_mb']} MB)")
+        elif res["status"] == "SKIPPED":
+            tprint(f"   ⏭  [{asset_id[:8]} 跳过] {res['filename']}")
+        else:
+            tprint(f"   ❌ [{asset_id[:8]} 失败] {res['filename']}: {res['error_message']}")
+
+    # 限制单个资产同时占用的线程数
+    slots = threading.BoundedSemaphore(PER_ASSET_WORKERS)
+    futures = []
+    for filename in others:
+        if filename in ledger_done:
+            _report(_skip_by_ledger(filename))
+            continue
+        slots.acquire()
+        fut = pool.submit(upload_one, client, bucket, asset_id, asset_dir_path, filename, remote)
+        fut.add_done_callback(lambda _f: slots.release())
+        futures.append(fut)
+
+    # 远端已确认存在的文件：本次成功/跳过的，加上台账中已完成的（本地分片可能已被清理）
+    uploaded = {f for f in ledger_done}
+    uploaded.update(
+        gcs_path.rsplit("/", 1)[-1] for gcs_path, entry in done_map.items() if entry[3] in DONE_STATUSES
+    )
+    segments_ok = True
+    for fut in as_completed(futures):
+        try:
+            res = fut.result()
+        except Exception as e:  # 本地文件读取等异常
+            segments_ok = False
+            tprint(f"   ❌ [{asset_id[:8]} 失败] {e}")
+            continue
+        if res["status"] == "FAILED" and res["file_type"] == "segment":
+            segments_ok = False
+        elif res["status"] != "FAILED":
+            uploaded.add(res["filename"])
+        _report(res)
+
+    # 播放列表引用的分片全部在远端后再上传播放列表
+    for filename in playlists:
+        local_path = os.path.join(asset_dir_path, filename)
+        try:
+            missing = [n for n in Playlist.load_cached(local_path).segment_names() if n not in uploaded]
+        except MasterPlaylistError:
+            missing = []  # 主播放列表只引用子播放列表，不引用分片
+        except (OSError, ValueError) as e:
+            missing = [f"(播放列表解析失败: {e})"]
+        if segments_ok and not missing and filename in ledger_done:
+            res = _skip_by_ledger(filename)
+        elif segments_ok and not missing:
+            res = upload_one(client, bucket, asset_id, asset_dir_path, filename, remote)
+        else:
+            reason = (f"播放列表引用的 {len(missing)} 个分片未上传（{missing[0]} 等）"
+                      if missing else "存在上传失败的分片")
+            res = finish_upload(
+                asset_id, filename, "playlist", local_path, f"{GCS_BASE_DIR}/{asset_id}/{filename}",
+                round(os.path.getsize(local_path) / 1024 / 1024, 2),
+                "FAILED", f"{reason}，暂不上传播放列表",
+            )
+        _report(res)
+
     # 排序segments列表
     asset_summary["files"]["segments"].sort(key=lambda x: x["filename"])
-    
-    print(f"   📊 完成: 成功={uploaded_count}, 跳过={skipped_count}, 失败={failed_count}")
-    
+    asset_summary["total_size_mb"] = round(asset_summary["total_size_mb"], 2)
+
+    flush_log()
+    if _ledger is not None:
+        _ledger.mark_asset(asset_id, fingerprint, counts["FAILED"] == 0, changed=counts["SUCCESS"] > 0)
+
+    tprint(f"   📊 [{asset_id[:8]}] 完成: 成功={counts['SUCCESS']}, 跳过={counts['SKIPPED']}, 失败={counts['FAILED']}")
+
     return asset_summary
 
 
 def upload_all_assets():
-    """上传所有资产目录"""
+    """上传所有资产目录（资产之间、资产内文件之间都并发）"""
+    global _ledger, _scheduler
+    _ledger = UploadLedger(LEDGER_DB)
+    _scheduler = UploadScheduler(
+        bandwidth_bytes_per_sec=BANDWIDTH_LIMIT_MBPS * 1000 * 1000 / 8,
+        min_workers=MIN_WORKERS,
+        max_workers=MAX_WORKERS,
+        adaptive=ADAPTIVE_CONCURRENCY,
+        max_retries=MAX_RETRIES,
+        backoff_base=BACKOFF_BASE_SEC,
+        backoff_max=BACKOFF_MAX_SEC,
+    )
     client = init_gcs_client()
     bucket = client.bucket(BUCKET_NAME)
     init_log()
-    
-    asset_summaries = {}
-    
+    summary_writer = SummaryWriter(ASSET_SUMMARY_JSONL, GCS_PUBLIC_URL_PREFIX, GCS_BASE_DIR)
+
     # 获取所有子目录
     subdirs = [d for d in os.listdir(LOCAL_OUTPUT_DIR) 
                if os.path.isdir(os.path.join(LOCAL_OUTPUT_DIR, d))]
@@ -243,32 +605,245 @@ def upload_all_assets():
     total_assets = len(subdirs)
     print(f"\n🚀 开始上传任务")
     print(f"   资产目录总数: {total_assets}")
+    print(f"   并发: 总计 {MAX_WORKERS} 个文件, 每资产 {PER_ASSET_WORKERS} 个, 同时 {ASSET_WORKERS} 个资产")
     print(f"   日志文件: {LOG_FILE}")
-    print(f"   汇总文件: {ASSET_SUMMARY_FILE}")
+    print(f"   汇总文件: {ASSET_SUMMARY_JSONL}")
+    print(f"   上传台账: {LEDGER_DB}")
+    print(f"   带宽上限: {BANDWIDTH_LIMIT_MBPS or '不限'} Mbps, 最多重试 {MAX_RETRIES} 次, "
+          f"自适应并发: {'开' if ADAPTIVE_CONCURRENCY else '关'}")
     print("=" * 60)
-    
-    for idx, asset_id in enumerate(subdirs, 1):
-        asset_dir_path = os.path.join(LOCAL_OUTPUT_DIR, asset_id)
-        
-        print(f"\n[{idx}/{total_assets}] ", end="")
-        asset_summary = upload_asset_directory(client, bucket, asset_dir_path, asset_id)
-        asset_summaries[asset_id] = asset_summary
-        
-        # 每处理10个资产保存一次汇总（防止数据丢失）
-        if idx % 10 == 0:
-            save_asset_summary(asset_summaries)
-            print(f"\n💾 已保存进度到 {ASSET_SUMMARY_FILE}")
-    
-    # 最终保存汇总
-    save_asset_summary(asset_summaries)
+
+    remote_all = None
+    if LIST_WHOLE_PREFIX:
+        remote_all = list_remote_objects(client, f"{GCS_BASE_DIR}/")
+        print(f"   远端已有对象: {len(remote_all)}")
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="upload") as file_pool, \
+            ThreadPoolExecutor(max_workers=ASSET_WORKERS, thread_name_prefix="asset") as asset_pool:
+        futures = {
+            asset_pool.submit(
+                upload_asset_directory, client, bucket,
+                os.path.join(LOCAL_OUTPUT_DIR, asset_id), asset_id, file_pool, remote_all
+            ): asset_id
+            for asset_id in subdirs
+        }
+        for fut in as_completed(futures):
+            asset_id = futures[fut]
+            done += 1
+            try:
+                asset_summary = fut.result()
+            except Exception as e:
+                tprint(f"\n❌ 资产 {asset_id} 处理异常: {e}")
+                continue
+            # 本次没有新上传文件的资产（全部跳过）不写汇总，避免覆盖之前的记录
+            if asset_summary["file_count"]:
+                summary_writer.append(asset_summary)
+            st = _scheduler.limiter.snapshot()
+            tprint(f"\n[{done}/{total_assets}] 资产完成: {asset_id}  "
+                   f"(并发 {st['limit']}, 吞吐 {st['throughput_mbps']} Mbps, 限流 {st['throttled']} 次, "
+                   f"错误率降速 {st['error_backoffs']} 次)")
+
+    summary_writer.close()
+    if WRITE_LEGACY_SUMMARY:
+        export_asset_summary()
+    flush_log()
+    _ledger.close()
+    _ledger = None
+
+    if EVICT_AFTER_UPLOAD:
+        evict_local_assets(client)
+    _scheduler = None
     
     print("\n" + "=" * 60)
     print(f"✅ 所有任务完成！")
     print(f"   处理资产数: {total_assets}")
     print(f"   详细日志: {LOG_FILE}")
-    print(f"   资产汇总: {ASSET_SUMMARY_FILE}")
-    print(f"   汇总文件包含所有资产的GCS路径和URL，可直接用于API调用")
+    print(f"   资产汇总: {ASSET_SUMMARY_JSONL}")
+    print(f"   汇总文件包含所有资产的GCS路径和URL，可用 summary.load_summaries() 读取")
+
+
+def patch_all_metadata():
+    """
+    批量修正 GCS_BASE_DIR 下已有对象的 Content-Type / Cache-Control（只改元数据，不重新上传）。
+    需要改变 Content-Encoding 的播放列表（GZIP_PLAYLISTS 开关变化）必须重新上传内容，
+    本地文件还在时直接重传。
+    """
+    global _scheduler
+    _scheduler = UploadScheduler(
+        min_workers=MIN_WORKERS, max_workers=MAX_WORKERS, adaptive=ADAPTIVE_CONCURRENCY,
+        max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE_SEC, backoff_max=BACKOFF_MAX_SEC,
+    )
+    client = init_gcs_client()
+    bucket = client.bucket(BUCKET_NAME)
+    remote = list_remote_objects(client, f"{GCS_BASE_DIR}/")
+    print(f"   远端对象: {len(remote)}")
+
+    counts = {"patched": 0, "reuploaded": 0, "ok": 0, "failed": 0}
+
+    def _fix(gcs_path, entry):
+        meta = object_metadata(os.path.basename(gcs_path))
+        if metadata_matches(entry, meta):
+            return "ok"
+        if entry[5] != meta[2]:
+            # asset_id/filename -> 本地文件
+            local_path = os.path.join(LOCAL_OUTPUT_DIR, *gcs_path.split("/")[1:])
+            if not os.path.isfile(local_path):
+                tprint(f"   ⚠️  {gcs_path}: Content-Encoding 需要重新上传，但本地文件不存在")
+                return "failed"
+            # remote={}：不做存在性检查，直接覆盖
+            status, result, _ = upload_file(client, bucket, gcs_path.split("/")[1], local_path, gcs_path, remote={})
+            if status == "FAILED":
+                tprint(f"   ❌ {gcs_path}: {result}")
+                return "failed"
+            return "reuploaded"
+        patch_metadata(bucket.blob(gcs_path), meta)
+        return "patched"
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="patch") as pool:
+        futures = {pool.submit(_fix, name, entry): name for name, entry in remote.items()}
+        for fut in as_completed(futures):
+            try:
+                counts[fut.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                tprint(f"   ❌ {futures[fut]}: {e}")
+    _scheduler = None
+
+    print(f"✅ 元数据已更新: {counts['patched']}, 重新上传: {counts['reuploaded']}, "
+          f"无需修改: {counts['ok']}, 失败: {counts['failed']}")
+
+
+def verify_remote_copies(client, asset_id, filenames, read_bucket=None):
+    """
+    返回远端已有且大小、校验和都与本地一致的文件名集合（清理前校验用）。
+    无论 VERIFY_CHECKSUM 如何设置都会读取本地文件计算校验和；远端没有校验和的文件不算通过。
+    """
+    remote = list_remote_objects(client, f"{GCS_BASE_DIR}/{asset_id}/")
+    verified = set()
+    for filename in filenames:
+        local_path = os.path.join(LOCAL_OUTPUT_DIR, asset_id, filename)
+        entry = remote.get(f"{GCS_BASE_DIR}/{asset_id}/{filename}")
+        if entry is None or entry[5]:
+            continue
+        size, crc32c, md5_hash = entry[:3]
+        local_size = os.path.getsize(local_path)
+        if size is None or int(size) != local_size:
+            continue
+        if read_bucket is not None:
+            read_bucket.consume(local_size)
+        if crc32c and google_crc32c is not None:
+            ok = _file_checksum_b64(local_path, "crc32c") == crc32c
+        elif md5_hash:
+            ok = _file_checksum_b64(local_path, "md5") == md5_hash
+        else:
+            ok = False
+        if ok:
+            verified.add(filename)
+    return verified
+
+
+def evict_local_assets(client=None, dry_run=False):
+    """按 DISK_BUDGET_GB / EVICT_MAX_AGE_DAYS 清理已上传资产的本地分片"""
+    if DISK_BUDGET_GB <= 0 and EVICT_MAX_AGE_DAYS <= 0:
+        print("   未设置 DISK_BUDGET_GB 或 EVICT_MAX_AGE_DAYS，不清理")
+        return
+    client = client or init_gcs_client()
+    ledger = UploadLedger(LEDGER_DB)
+    try:
+        eligible = ledger.completed_asset_ids()
+    finally:
+        ledger.close()
+
+    assets = scan_assets(LOCAL_OUTPUT_DIR)
+    total = sum(a[2] for a in assets)
+    plan = plan_evictions(
+        assets, eligible,
+        budget_bytes=int(DISK_BUDGET_GB * 1024 ** 3),
+        max_age_sec=EVICT_MAX_AGE_DAYS * 86400,
+    )
+    print(f"\n🧹 本地清理{'（试运行）' if dry_run else ''}: 输出目录 {total / 1024 ** 3:.2f} GB, "
+          f"上限 {DISK_BUDGET_GB or '-'} GB, 待清理资产 {len(plan)} 个")
+
+    read_bucket = TokenBucket(EVICT_READ_MB_PER_SEC * 1024 * 1024) if EVICT_READ_MB_PER_SEC > 0 else None
+    evictor = Evictor(
+        LOCAL_OUTPUT_DIR,
+        verify=lambda asset_id, names: verify_remote_copies(client, asset_id, names, read_bucket),
+        batch_files=EVICT_BATCH_FILES,
+        batch_pause=EVICT_BATCH_PAUSE_SEC,
+        dry_run=dry_run,
+        log=tprint,
+    )
+    totals = evictor.run(plan)
+    print(f"✅ 清理完成: {totals['assets']} 个资产, 删除 {totals['deleted']} 个分片, "
+          f"释放 {totals['freed_bytes'] / 1024 ** 3:.2f} GB, 未通过校验保留 {totals['unverified']} 个")
+
+
+def rebuild_from_ledger():
+    """从本地台账重新生成 CSV 日志和资产汇总（包含所有历史上传，不访问网络）"""
+    ledger = UploadLedger(LEDGER_DB)
+    n = ledger.export_csv(LOG_FILE)
+
+    writer = SummaryWriter(ASSET_SUMMARY_JSONL, GCS_PUBLIC_URL_PREFIX, GCS_BASE_DIR, truncate=True)
+    count = 0
+    summary = None
+    # iter_rows 按 asset_id 排序，一次只在内存中保留一个资产
+    for r in ledger.iter_rows(statuses=("SUCCESS", "SKIPPED")):
+        if summary is not None and summary["asset_id"] != r["asset_id"]:
+            summary["total_size_mb"] = round(summary["total_size_mb"], 2)
+            writer.append(summary)
+            count += 1
+            summary = None
+        if summary is None:
+            summary = {
+                "asset_id": r["asset_id"],
+                "uploaded_at": "",
+                "files": {"playlist": None, "segments": [], "cover": None, "metadata": None, "other": []},
+                "total_size_mb": 0,
+                "file_count": 0
+            }
+        summary["uploaded_at"] = max(summary["uploaded_at"], r["uploaded_at"] or "")
+        add_to_summary(summary, {
+            "filename": r["filename"],
+            "file_type": r["file_type"],
+            "gcs_path": r["gcs_path"],
+            "gcs_url": r["gcs_url"] or f"{GCS_PUBLIC_URL_PREFIX}/{r['gcs_path']}",
+            "size_mb": round((r["size"] or 0) / 1024 / 1024, 2),
+        })
+    if summary is not None:
+        summary["total_size_mb"] = round(summary["total_size_mb"], 2)
+        writer.append(summary)
+        count += 1
+    writer.close()
+    ledger.close()
+
+    print(f"✅ 已从台账重建: {LOG_FILE} ({n} 行), {ASSET_SUMMARY_JSONL} ({count} 个资产)")
+    if WRITE_LEGACY_SUMMARY:
+        export_asset_summary()
 
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser("GCS HLS uploader")
+    ap.add_argument("--rebuild-logs", action="store_true",
+                    help="只从本地台账重新生成CSV日志和asset_summary，不上传")
+    ap.add_argument("--export-summary", action="store_true",
+                    help=f"只把 {ASSET_SUMMARY_JSONL} 还原为旧格式 {ASSET_SUMMARY_FILE}，不上传")
+    ap.add_argument("--patch-metadata", action="store_true",
+                    help="只批量修正远端已有对象的 Content-Type/Cache-Control，不上传新文件")
+    ap.add_argument("--evict", action="store_true",
+                    help="只清理已上传并校验通过的本地分片（按 DISK_BUDGET_GB / EVICT_MAX_AGE_DAYS）")
+    ap.add_argument("--dry-run", action="store_true", help="配合 --evict：只校验和统计，不删除")
+    args = ap.parse_args()
+    if args.rebuild_logs:
+        rebuild_from_ledger()
+        sys.exit(0)
+    if args.export_summary:
+        export_asset_summary()
+        sys.exit(0)
+    if args.evict:
+        evict_local_assets(dry_run=args.dry_run)
+        sys.exit(0)
+    if args.patch_metadata:
+        patch_all_metadata()
+        sys.exit(0)
     upload_all_assets()
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+HLS load generator for local_hls_key_api.py (no extra deps).
+
+Simulates N concurrent players for --duration seconds. Each player runs
+playback sessions back-to-back until the time is up; a session:
+  1. GETs the playlist
+  2. GETs the key URI referenced by #EXT-X-KEY (if any)
+  3. GETs the segments in order, either at real-time pacing (sleeping to
+     follow #EXTINF durations) or as fast as possible
+(--once: a single session per player; --duration then only caps the run)
+
+Assets are discovered under --root (same layout the server serves:
+<root>/<asset_id>/*.m3u8) and assigned to players round-robin, rotating to
+the next asset on every new session.
+
+A key URI that is not under --base-url (e.g. the production key server when
+the local server runs without --rewrite-key-uri) is still fetched, but a
+warning is printed and the hosts are listed under "external_key_hosts".
+
+Reports p50/p95/p99 time-to-first-byte, throughput and error rates as JSON.
+
+Usage (PowerShell):
+  python local_hls_key_api.py --root .\\output --key .\\enc.key --port 8080 --rewrite-key-uri
+  python hls_load_test.py --root .\\output --base-url http://127.0.0.1:8080 --players 50 --duration 60
+  python hls_load_test.py --root .\\output --players 200 --pace max --max-segments 20 --out bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urljoin, urlparse
+from urllib.request import Request, urlopen
+
+from hls_playlist import Playlist
+
+READ_CHUNK = 64 * 1024
+
+
+def discover_assets(root: Path, asset: str = "") -> List[Tuple[str, str]]:
+    """Return [(asset_id, playlist_name)] for asset dirs under root."""
+    out: List[Tuple[str, str]] = []
+    dirs = [root / asset] if asset else sorted(p for p in root.iterdir() if p.is_dir())
+    for d in dirs:
+        playlists = sorted(d.glob("*.m3u8"))
+        if playlists:
+            # newest playlist wins (packager names them playlist_<stamp>.m3u8)
+            out.append((d.name, playlists[-1].name))
+    return out
+
+
+def parse_playlist(text: str) -> Tuple[Optional[str], List[Tuple[str, float]]]:
+    """Return (key_uri, [(segment_uri, duration), ...])."""
+    pl = Playlist.parse(text)
+    key = pl.key_for(0) if len(pl) else None
+    key_uri = key.get("URI") if key else None
+    return key_uri, list(zip(pl.uris, pl.durations))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, math.ceil(pct / 100.0 * len(s)) - 1))
+    return s[k]
+
+
+class Stats:
+    """Thread-safe per-kind (playlist/key/segment) request stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ttfb: Dict[str, List[float]] = {}
+        self.total: Dict[str, List[float]] = {}
+        self.bytes: Dict[str, int] = {}
+        self.ok: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: List[str] = []
+        self.stalls = 0
+        self.sessions = 0
+        self.external_key_hosts: Dict[str, int] = {}
+
+    def record(self, kind: str, ttfb: float, total: float, nbytes: int) -> None:
+        with self._lock:
+            self.ttfb.setdefault(kind, []).append(ttfb)
+            self.total.setdefault(kind, []).append(total)
+            self.bytes[kind] = self.bytes.get(kind, 0) + nbytes
+            self.ok[kind] = self.ok.get(kind, 0) + 1
+
+    def record_error(self, kind: str, err: str) -> None:
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            if len(self.error_samples) < 20:
+                self.error_samples.append(f"{kind}: {err}")
+
+    def record_stall(self) -> None:
+        with self._lock:
+            self.stalls += 1
+
+    def record_session(self) -> None:
+        with self._lock:
+            self.sessions += 1
+
+    def record_external_key(self, key_url: str) -> None:
+        host = urlparse(key_url).netloc or key_url
+        with self._lock:
+            first = host not in self.external_key_hosts
+            self.external_key_hosts[host] = self.external_key_hosts.get(host, 0) + 1
+        if first:
+            print(f"WARNING: key URI {key_url} is not under --base-url; key requests leave the local server "
+                  f"(start it with --rewrite-key-uri)", file=sys.stderr)
+
+    def report(self, elapsed: float, players: int, pace: str) -> dict:
+        with self._lock:
+            kinds = sorted(set(self.ok) | set(self.errors))
+            per_kind = {}
+            for k in kinds:
+                ok = self.ok.get(k, 0)
+                err = self.errors.get(k, 0)
+                ttfb = self.ttfb.get(k, [])
+                total = self.total.get(k, [])
+                per_kind[k] = {
+                    "requests": ok + err,
+                    "errors": err,
+                    "error_rate": round(err / (ok + err), 4) if ok + err else 0.0,
+                    "bytes": self.bytes.get(k, 0),
+                    "ttfb_ms": {
+                        "p50": round(percentile(ttfb, 50) * 1000, 3),
+                        "p95": round(percentile(ttfb, 95) * 1000, 3),
+                        "p99": round(percentile(ttfb, 99) * 1000, 3),
+                        "max": round(max(ttfb) * 1000, 3) if ttfb else 0.0,
+                    },
+                    "total_ms": {
+                        "p50": round(percentile(total, 50) * 1000, 3),
+                        "p95": round(percentile(total, 95) * 1000, 3),
+                        "p99": round(percentile(total, 99) * 1000, 3),
+                    },
+                }
+            all_req = sum(v["requests"] for v in per_kind.values())
+            all_err = sum(v["errors"] for v in per_kind.values())
+            all_bytes = sum(self.bytes.values())
+            return {
+                "players": players,
+                "pace": pace,
+                "elapsed_sec": round(elapsed, 3),
+                "requests": all_req,
+                "errors": all_err,
+                "error_rate": round(all_err / all_req, 4) if all_req else 0.0,
+                "requests_per_sec": round(all_req / elapsed, 2) if elapsed else 0.0,
+                "bytes": all_bytes,
+                "throughput_mbps": round(all_bytes * 8 / elapsed / 1e6, 3) if elapsed else 0.0,
+                "sessions": self.sessions,
+                "stalls": self.stalls,
+                "external_key_hosts": dict(self.external_key_hosts),
+                "by_kind": per_kind,
+                "error_samples": list(self.error_samples),
+            }
+
+
+def fetch(url: str, timeout: float) -> Tuple[float, float, bytes]:
+    """GET url; return (ttfb_sec, total_sec, body)."""
+    t0 = time.perf_counter()
+    with urlopen(Request(url, headers={"User-Agent": "hls-load-test/1.0"}), timeout=timeout) as resp:
+        # urlopen returns once the status line + headers have arrived
+        first = resp.read(1)
+        ttfb = time.perf_counter() - t0
+        chunks = [first]
+        while True:
+            chunk = resp.read(READ_CHUNK)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return ttfb, time.perf_counter() - t0, b"".join(chunks)
+
+
+def play_session(
+    playlist_url: str,
+    base_url: str,
+    stats: Stats,
+    stop_at: float,
+    pace: str,
+    max_segments: int,
+    timeout: float,
+) -> bool:
+    """One playback of playlist_url; False if the playlist could not be fetched/parsed."""
+    stats.record_session()
+    try:
+        ttfb, total, body = fetch(playlist_url, timeout)
+        stats.record("playlist", ttfb, total, len(body))
+        key_uri, segments = parse_playlist(body.decode("utf-8", errors="replace"))
+    except (HTTPError, URLError, OSError, ValueError) as e:
+        stats.record_error("playlist", str(e))
+        return False
+
+    if key_uri:
+        key_url = urljoin(playlist_url, key_uri)
+        if not key_url.startswith(base_url + "/"):
+            stats.record_external_key(key_url)
+        try:
+            ttfb, total, data = fetch(key_url, timeout)
+            stats.record("key", ttfb, total, len(data))
+        except (HTTPError, URLError, OSError) as e:
+            stats.record_error("key", str(e))
+
+    if max_segments > 0:
+        segments = segments[:max_segments]
+
+    # real-time pacing: segment i is due at start + sum(durations[:i])
+    start = time.perf_counter()
+    due = 0.0
+    for seg_uri, dur in segments:
+        now = time.perf_counter()
+        if now >= stop_at:
+            break
+        if pace == "realtime":
+            wait = start + due - now
+            if wait > 0:
+                time.sleep(min(wait, max(0.0, stop_at - now)))
+            elif due > 0 and -wait > dur:
+                # more than one segment behind schedule -> a real player would rebuffer
+                stats.record_stall()
+        try:
+            ttfb, total, data = fetch(urljoin(playlist_url, seg_uri), timeout)
+            stats.record("segment", ttfb, total, len(data))
+        except (HTTPError, URLError, OSError) as e:
+            stats.record_error("segment", str(e))
+        due += dur
+    return True
+
+
+def run_player(
+    player: int,
+    playlist_urls: List[str],
+    base_url: str,
+    stats: Stats,
+    stop_at: float,
+    pace: str,
+    max_segments: int,
+    timeout: float,
+    once: bool = False,
+) -> None:
+    """Start a new session as soon as the previous one ends, until stop_at (or once)."""
+    session = 0
+    while time.perf_counter() < stop_at:
+        # players start round-robin over assets, then move to the next asset per session
+        url = playlist_urls[(player + session) % len(playlist_urls)]
+        ok = play_session(url, base_url, stats, stop_at, pace, max_segments, timeout)
+        session += 1
+        if once:
+            break
+        if not ok:
+            # failing playlist: don't spin on it
+            time.sleep(min(1.0, max(0.0, stop_at - time.perf_counter())))
+
+
+def main():
+    ap = argparse.ArgumentParser("HLS load generator for local_hls_key_api.py")
+    ap.add_argument("--root", default="output", help="HLS root folder used to discover assets (default: ./output)")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8080", help="Server base URL (default: http://127.0.0.1:8080)")
+    ap.add_argument("--asset", default="", help="Only use this asset_id (default: all assets under --root)")
+    ap.add_argument("--players", type=int, default=10, help="Concurrent simulated players (default 10)")
+    ap.add_argument("--pace", choices=["realtime", "max"], default="realtime",
+                    help="realtime: follow #EXTINF durations; max: fetch segments back-to-back")
+    ap.add_argument("--duration", type=float, default=30.0,
+                    help="Seconds of load: players keep starting new sessions until then (default 30)")
+    ap.add_argument("--once", action="store_true", help="One playback session per player (duration only caps it)")
+    ap.add_argument("--max-segments", type=int, default=0, help="Segments per player (default 0 = all)")
+    ap.add_argument("--ramp-up", type=float, default=0.0, help="Spread player start over N seconds (default 0)")
+    ap.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds (default 30)")
+    ap.add_argument("--out", default="", help="Write JSON report to this file (default: stdout only)")
+    args = ap.parse_args()
+
+    root = Path(args.root).resolve()
+    if not root.is_dir():
+        raise SystemExit(f"Root not found: {root}")
+    assets = discover_assets(root, args.asset)
+    if not assets:
+        raise SystemExit(f"No asset with a .m3u8 playlist found under: {root}")
+
+    base = args.base_url.rstrip("/")
+    urls = [f"{base}/hls/{quote(a)}/{quote(p)}" for a, p in assets]
+
+    stats = Stats()
+    t0 = time.perf_counter()
+    stop_at = t0 + args.duration
+    threads = []
+    for i in range(args.players):
+        t = threading.Thread(
+            target=run_player,
+            args=(i, urls, base, stats, stop_at, args.pace, args.max_segments, args.timeout, args.once),
+            daemon=True,
+        )
+        threads.append(t)
+        t.start()
+        if args.ramp_up > 0 and args.players > 1:
+            time.sleep(args.ramp_up / (args.players - 1))
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    report = stats.report(elapsed, args.players, args.pace)
+    report["base_url"] = base
+    report["assets"] = len(assets)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ import hashlib
 import json
 import logging
 import math
+import re
 import shutil
 import subprocess
 import sys
@@ -15,6 +16,8 @@ from typing import Dict, List, Optional, Tuple
 
 from tqdm import tqdm
 
+from hls_playlist import Playlist
+
 
 # -----------------------------
 # Basic utils
@@ -110,6 +113,109 @@ def generate_cover(input_path: Path, cover_path: Path, seek_sec: float) -> None:
     if p.returncode != 0:
         raise RuntimeError(f"ffmpeg cover failed:\n{p.stderr}")
 
+# smart cover: candidates are downscaled to this many gray pixels for scoring
+COVER_SCORE_W, COVER_SCORE_H = 64, 36
+SHOWINFO_PTS_RE = re.compile(r"pts_time:\s*(-?[\d.]+)")
+FFMPEG_VERSION_RE = re.compile(r"ffmpeg version n?(\d+)\.(\d+)")
+
+_passthrough_args: Optional[List[str]] = None
+
+def ffmpeg_passthrough_args(logger: Optional[logging.Logger] = None) -> List[str]:
+    """
+    Output options that pass frames through without dup/drop. -fps_mode needs
+    ffmpeg 5.1+; older builds only know -vsync. Git builds ("N-...") report no
+    release number and are assumed new. Detected once per process.
+    """
+    global _passthrough_args
+    if _passthrough_args is None:
+        p = run(["ffmpeg", "-hide_banner", "-version"])
+        m = FFMPEG_VERSION_RE.match(p.stdout or "")
+        if m and (int(m.group(1)), int(m.group(2))) < (5, 1):
+            _passthrough_args = ["-vsync", "passthrough"]
+            if logger:
+                logger.info(f"ffmpeg {m.group(1)}.{m.group(2)} has no -fps_mode, using -vsync passthrough")
+        else:
+            _passthrough_args = ["-fps_mode", "passthrough"]
+    return _passthrough_args
+
+def score_cover_frame(gray: bytes) -> Tuple[float, float, float]:
+    """
+    Cheap cover score for a small 8-bit gray frame -> (score, brightness, entropy).
+    Entropy (bits, 0..8) rewards detail; near-black/near-white frames (fades,
+    title cards) are scaled down towards 0.
+    """
+    n = len(gray)
+    if not n:
+        return 0.0, 0.0, 0.0
+    hist = [0] * 256
+    for v in gray:
+        hist[v] += 1
+    mean = sum(i * c for i, c in enumerate(hist)) / n
+    entropy = abs(sum((c / n) * math.log2(c / n) for c in hist if c))
+    exposure = min(1.0, mean / 48.0) * min(1.0, (255.0 - mean) / 48.0)
+    return entropy * max(0.0, exposure), mean, entropy
+
+def generate_cover_smart(input_path: Path, cover_path: Path, duration: float, candidates: int = 12,
+                         logger: Optional[logging.Logger] = None) -> dict:
+    """
+    Keyframe-sampled cover: one ffmpeg pass with -skip_frame nokey (only
+    keyframes are decoded) picks up to `candidates` keyframes spread over
+    5%..90% of the duration and pipes them out as tiny gray thumbnails; the
+    best-scoring one is then extracted full size with generate_cover() at its
+    timestamp. Returns the selection info recorded in meta.json.
+    """
+    start = duration * 0.05
+    span = duration * 0.85
+    step = span / max(1, candidates)
+    select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{step:.3f})'"
+    frame_bytes = COVER_SCORE_W * COVER_SCORE_H
+    p = subprocess.run([
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "info", "-nostats",
+        "-skip_frame", "nokey",
+        "-ss", f"{start:.3f}", "-t", f"{span:.3f}",
+        "-i", str(input_path),
+        "-an", "-sn", "-dn",
+        "-vf", f"{select},scale={COVER_SCORE_W}:{COVER_SCORE_H},format=gray,showinfo",
+        *ffmpeg_passthrough_args(logger), "-f", "rawvideo", "pipe:1",
+    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = p.stderr.decode("utf-8", errors="replace")
+    if p.returncode != 0:
+        raise RuntimeError(f"ffmpeg smart cover failed:\n{stderr[-2000:]}")
+    thumbs = [p.stdout[i:i + frame_bytes] for i in range(0, len(p.stdout) - frame_bytes + 1, frame_bytes)]
+    times = [start + float(t) for t in SHOWINFO_PTS_RE.findall(stderr)]
+    if not thumbs:
+        raise RuntimeError("ffmpeg smart cover produced no keyframes")
+    if len(times) != len(thumbs) or len(p.stdout) != len(thumbs) * frame_bytes:
+        raise RuntimeError(f"ffmpeg smart cover: {len(thumbs)} frames ({len(p.stdout)} bytes) "
+                           f"but {len(times)} showinfo timestamps")
+    scored = [score_cover_frame(t) for t in thumbs]
+    best = max(range(len(thumbs)), key=lambda i: scored[i][0])
+    chosen_sec = max(0.0, times[best])
+    generate_cover(input_path, cover_path, chosen_sec)
+    score, brightness, entropy = scored[best]
+    return {
+        "mode": "smart",
+        "candidates": len(thumbs),
+        "chosen_index": best,
+        "chosen_sec": round(chosen_sec, 3),
+        "score": round(score, 4),
+        "brightness": round(brightness, 2),
+        "entropy": round(entropy, 4),
+    }
+
+def pick_cover(input_path: Path, cover_path: Path, duration: float, mode: str, candidates: int,
+               logger: Optional[logging.Logger] = None) -> dict:
+    """Cover by `mode` ('smart' or 'seek'); smart falls back to the 10% seek on any failure."""
+    if mode == "smart" and duration >= 2.0:
+        try:
+            return generate_cover_smart(input_path, cover_path, duration, candidates, logger)
+        except Exception as e:
+            if logger:
+                logger.warning(f"smart cover failed, falling back to seek: {str(e).splitlines()[0]}")
+    seek_sec = pick_cover_seek(duration)
+    generate_cover(input_path, cover_path, seek_sec)
+    return {"mode": "seek", "chosen_sec": round(seek_sec, 3)}
+
 def read_key_url_from_keyinfo(keyinfo_path: Path) -> str:
     lines = keyinfo_path.read_text(encoding="utf-8", errors="replace").splitlines()
     if not lines or not lines[0].strip():
@@ -258,6 +364,8 @@ def process_one(
     logger: logging.Logger,
     hls_time: int,
     retries: int,
+    cover_mode: str = "smart",
+    cover_candidates: int = 12,
 ) -> bool:
     """
     Returns True if success, False if final failure.
@@ -300,17 +408,22 @@ def process_one(
             save_state(state_path, state)
 
             # gather meta
+            timing = {}
+            t0 = time.perf_counter()
             duration, width, height = ffprobe_duration_and_size(src_path)
             duration_sec = int(math.floor(duration + 0.5))
-            seek_sec = pick_cover_seek(duration)
+            timing["probe_sec"] = round(time.perf_counter() - t0, 3)
 
             # cover
-            generate_cover(src_path, cover_path, seek_sec)
+            t0 = time.perf_counter()
+            cover_info = pick_cover(src_path, cover_path, duration, cover_mode, cover_candidates, logger)
+            timing["cover_sec"] = round(time.perf_counter() - t0, 3)
 
             # write temp keyinfo (ensures local key path is correct)
             write_temp_keyinfo(temp_keyinfo_path, key_url=key_url, local_key_path=local_key_path)
 
             # package
+            t0 = time.perf_counter()
             playlist_path = package_hls_encrypted(
                 input_path=src_path,
                 out_dir=asset_out_dir,
@@ -319,6 +432,15 @@ def process_one(
                 playlist_filename=playlist_filename,
             )
 
+            timing["package_sec"] = round(time.perf_counter() - t0, 3)
+
+            # segment index (durations/sizes) + binary sidecar for the server/uploader
+            t0 = time.perf_counter()
+            index = Playlist.load(playlist_path)
+            index.fill_sizes(asset_out_dir)
+            index.save_sidecar(playlist_path)
+            timing["index_sec"] = round(time.perf_counter() - t0, 3)
+
             # write mapping files
             source_title_txt.write_text(src_path.stem, encoding="utf-8")
             source_filename_txt.write_text(src_path.name, encoding="utf-8")
@@ -339,9 +461,13 @@ def process_one(
                     "playlist": playlist_path.name,
                     "cover": cover_filename,
                     "segments_pattern": "seg_%05d.ts",
+                    "segment_count": len(index),
+                    "segments_bytes": index.total_bytes,
                     "encryption": "AES-128",
                     "key_uri": key_url,
-                }
+                },
+                "cover_pick": cover_info,
+                "timing": timing,
             }
             atomic_write_json(meta_path, meta)
 
@@ -424,6 +550,10 @@ def main() -> None:
     ap.add_argument("--rerun-failed", action="store_true", help="Only rerun from failed_list.txt")
     ap.add_argument("--clear-failed-on-success", action="store_true", help="When rerun failed, remove successful from failed_list.txt")
     ap.add_argument("--verbose", action="store_true", help="More console logs")
+    ap.add_argument("--cover-mode", choices=["smart", "seek"], default="smart",
+                    help="smart: score keyframes across the video in one keyframe-only pass; "
+                         "seek: frame at 10%% of duration (default smart)")
+    ap.add_argument("--cover-candidates", type=int, default=12, help="Keyframes sampled in smart mode (default 12)")
     args = ap.parse_args()
 
     which_or_die("ffmpeg")
@@ -520,6 +650,8 @@ def main() -> None:
                 logger=logger,
                 hls_time=int(args.hls_time),
                 retries=int(args.retries),
+                cover_mode=args.cover_mode,
+                cover_candidates=max(1, int(args.cover_candidates)),
             )
             if ok:
                 success_paths.add(str(src.resolve()))
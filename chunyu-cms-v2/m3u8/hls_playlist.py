@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Compact HLS media playlist model shared by the packager, the uploader and the
+local server (no extra deps).
+
+- Playlist.parse(text) / Playlist.load(path) -> per-segment durations, byte
+  sizes and cumulative start offsets in array('d'/'q'), segment URIs, and the
+  EXT-X-KEY tag in effect for each segment
+- dumps() serialises the whole playlist or a [first, last) segment range,
+  optionally rewriting every key URI; render_window() cuts a time window.
+  Lines the model does not know about are carried over verbatim, but the
+  output is regenerated text (durations re-formatted, managed tags
+  re-emitted): to serve a whole playlist unchanged apart from the key URI,
+  use rewrite_key_uri() on the original text instead
+- Master playlists (#EXT-X-STREAM-INF) are rejected with MasterPlaylistError
+- fill_sizes(dir) stats the segments once; total_bytes / total_duration are
+  then O(1)
+- A binary sidecar (<asset_dir>/.hlsidx/<playlist>.idx) caches the parsed form,
+  keyed by the playlist's mtime/size, so hot paths never re-parse text:
+    pl = Playlist.load_cached(path)
+  The sidecar lives in a sub-directory so per-file scans of the asset
+  directory (uploader, fingerprints, eviction) never see it.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import math
+import os
+import re
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+KEY_LINE_RE = re.compile(r'(#EXT-X-KEY:.*?URI=")([^"]+)(".*)', re.IGNORECASE)
+EXTINF_RE = re.compile(r"#EXTINF:\s*([\d.]+)\s*(?:,(.*))?$", re.IGNORECASE)
+KEY_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+SIDECAR_DIR = ".hlsidx"
+SIDECAR_MAGIC = b"HLSIDX2\n"
+# source mtime_ns, source size, segment count, json length
+_SIDECAR_HEAD = struct.Struct("<qqii")
+
+# tags the model regenerates itself; everything else before the first segment is kept verbatim
+_MANAGED_HEADER = ("#EXTM3U", "#EXT-X-VERSION:", "#EXT-X-TARGETDURATION:", "#EXT-X-MEDIA-SEQUENCE:",
+                   "#EXT-X-PLAYLIST-TYPE:", "#EXT-X-ENDLIST")
+
+
+# tags that only appear in master playlists
+_MASTER_TAGS = ("#EXT-X-STREAM-INF", "#EXT-X-I-FRAME-STREAM-INF", "#EXT-X-MEDIA:", "#EXT-X-SESSION-")
+
+
+class MasterPlaylistError(ValueError):
+    """Raised by Playlist.parse() for master (variant) playlists, which the model does not represent."""
+
+
+def rewrite_key_uri(text: str, key_uri: str) -> str:
+    """Point every EXT-X-KEY URI in playlist text at key_uri."""
+    return KEY_LINE_RE.sub(lambda m: m.group(1) + key_uri + m.group(3), text)
+
+
+def parse_key_attrs(tag: str) -> Dict[str, str]:
+    """'#EXT-X-KEY:METHOD=AES-128,URI="k",IV=0x..' -> {'METHOD': 'AES-128', 'URI': 'k', 'IV': '0x..'}"""
+    body = tag.split(":", 1)[1] if ":" in tag else ""
+    return {k.upper(): v.strip('"') for k, v in KEY_ATTR_RE.findall(body)}
+
+
+class Playlist:
+    """
+    Parsed VOD media playlist. Per-segment data lives in parallel arrays;
+    sizes are -1 until fill_sizes() (or a sidecar) provides them.
+    key_idx[i] indexes key_tags (-1 = no key in effect).
+    seg_tags keeps any other per-segment tags (e.g. #EXT-X-DISCONTINUITY)
+    and titles keeps non-empty EXTINF titles, both sparsely by segment index;
+    footer keeps tags after the last segment (other than ENDLIST).
+    """
+
+    __slots__ = ("version", "target_duration", "media_sequence", "playlist_type", "endlist",
+                 "header", "footer", "durations", "offsets", "sizes", "uris", "key_idx", "key_tags",
+                 "seg_tags", "titles")
+
+    def __init__(self):
+        self.version = 3
+        self.target_duration = 0
+        self.media_sequence = 0
+        self.playlist_type = ""
+        self.endlist = False
+        self.header: List[str] = []
+        self.footer: List[str] = []
+        self.durations = array("d")
+        self.offsets = array("d")
+        self.sizes = array("q")
+        self.uris: List[str] = []
+        self.key_idx = array("i")
+        self.key_tags: List[str] = []
+        self.seg_tags: Dict[int, List[str]] = {}
+        self.titles: Dict[int, str] = {}
+
+    # ---------- parse ----------
+    @classmethod
+    def parse(cls, text: str) -> "Playlist":
+        pl = cls()
+        cur_key = -1
+        dur = 0.0
+        title = ""
+        total = 0.0
+        pending: List[str] = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                up = line.upper()
+                if up.startswith("#EXTINF:"):
+                    m = EXTINF_RE.match(line)
+                    dur = float(m.group(1)) if m else 0.0
+                    title = (m.group(2) or "") if m else ""
+                elif up.startswith(_MASTER_TAGS):
+                    raise MasterPlaylistError("master playlist (variant streams), not a media playlist")
+                elif up.startswith("#EXT-X-KEY:"):
+                    pl.key_tags.append(line)
+                    cur_key = len(pl.key_tags) - 1
+                elif up.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                    pl.media_sequence = int(line.split(":", 1)[1])
+                elif up.startswith("#EXT-X-VERSION:"):
+                    pl.version = int(line.split(":", 1)[1])
+                elif up.startswith("#EXT-X-TARGETDURATION:"):
+                    pl.target_duration = int(float(line.split(":", 1)[1]))
+                elif up.startswith("#EXT-X-PLAYLIST-TYPE:"):
+                    pl.playlist_type = line.split(":", 1)[1].strip()
+                elif up.startswith("#EXT-X-ENDLIST"):
+                    pl.endlist = True
+                elif up.startswith("#EXTM3U"):
+                    pass
+                elif pl.uris or pending or up.startswith("#EXT-X-DISCONTINUITY") or up.startswith("#EXT-X-BYTERANGE"):
+                    pending.append(line)
+                else:
+                    pl.header.append(line)
+                continue
+            if pending:
+                pl.seg_tags[len(pl.uris)] = pending
+                pending = []
+            pl.durations.append(dur)
+            pl.offsets.append(total)
+            pl.sizes.append(-1)
+            pl.uris.append(line)
+            pl.key_idx.append(cur_key)
+            if title:
+                pl.titles[len(pl.uris) - 1] = title
+            total += dur
+            dur = 0.0
+            title = ""
+        pl.footer = pending
+        return pl
+
+    @classmethod
+    def load(cls, path) -> "Playlist":
+        return cls.parse(Path(path).read_text(encoding="utf-8", errors="replace"))
+
+    # ---------- queries ----------
+    def __len__(self) -> int:
+        return len(self.uris)
+
+    @property
+    def total_duration(self) -> float:
+        return (self.offsets[-1] + self.durations[-1]) if self.uris else 0.0
+
+    @property
+    def total_bytes(self) -> int:
+        """Sum of known segment sizes (-1 entries are not counted)."""
+        return sum(s for s in self.sizes if s > 0)
+
+    @property
+    def sizes_known(self) -> bool:
+        return all(s >= 0 for s in self.sizes)
+
+    def window(self, start: float, end: float) -> Tuple[int, int]:
+        """Segment range [first, last) overlapping the time window [start, end); empty past the end."""
+        if start >= self.total_duration:
+            return len(self.uris), len(self.uris)
+        first = max(0, bisect.bisect_right(self.offsets, start) - 1)
+        last = bisect.bisect_left(self.offsets, end)
+        return first, max(first, last)
+
+    def segment_at(self, t: float) -> int:
+        """Index of the segment playing at time t (clamped)."""
+        if not self.uris:
+            return -1
+        return min(len(self.uris) - 1, max(0, bisect.bisect_right(self.offsets, t) - 1))
+
+    def key_for(self, i: int) -> Optional[Dict[str, str]]:
+        k = self.key_idx[i]
+        return parse_key_attrs(self.key_tags[k]) if k >= 0 else None
+
+    def segment_names(self) -> List[str]:
+        """Local file names of the segments (URI without query/path)."""
+        return [u.split("?", 1)[0].rsplit("/", 1)[-1] for u in self.uris]
+
+    # ---------- mutate ----------
+    def set_key_uri(self, key_uri: str) -> None:
+        self.key_tags = [rewrite_key_uri(t, key_uri) for t in self.key_tags]
+
+    def fill_sizes(self, base_dir) -> int:
+        """stat() every segment under base_dir; missing files stay -1. Returns missing count."""
+        base = str(base_dir)
+        missing = 0
+        for i, name in enumerate(self.segment_names()):
+            try:
+                self.sizes[i] = os.stat(os.path.join(base, name)).st_size
+            except OSError:
+                self.sizes[i] = -1
+                missing += 1
+        return missing
+
+    # ---------- serialise ----------
+    def dumps(self, key_uri: Optional[str] = None, first: int = 0, last: Optional[int] = None,
+              playlist_type: Optional[str] = None) -> str:
+        """
+        Playlist text for segments [first, last). EXT-X-MEDIA-SEQUENCE keeps
+        the original numbering: without an explicit IV, AES-128 uses the
+        media sequence number as IV, so it must not be renumbered.
+        """
+        last = len(self.uris) if last is None else last
+        target = self.target_duration if (first, last) == (0, len(self.uris)) else 0
+        target = max(target, int(math.ceil(max((self.durations[i] for i in range(first, last)), default=0.0))))
+        ptype = self.playlist_type if playlist_type is None else playlist_type
+        out = [
+            "#EXTM3U",
+            f"#EXT-X-VERSION:{self.version}",
+            f"#EXT-X-TARGETDURATION:{target}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence + first}",
+        ]
+        if ptype:
+            out.append(f"#EXT-X-PLAYLIST-TYPE:{ptype}")
+        out.extend(self.header)
+        cur_key = -1
+        for i in range(first, last):
+            out.extend(self.seg_tags.get(i, ()))
+            k = self.key_idx[i]
+            if k != cur_key and k >= 0:
+                tag = self.key_tags[k]
+                out.append(rewrite_key_uri(tag, key_uri) if key_uri is not None else tag)
+            cur_key = k
+            out.append(f"#EXTINF:{self.durations[i]:.6f},{self.titles.get(i, '')}")
+            out.append(self.uris[i])
+        if last == len(self.uris):
+            out.extend(self.footer)
+        if self.endlist or ptype == "VOD":
+            out.append("#EXT-X-ENDLIST")
+        return "\n".join(out) + "\n"
+
+    def render_window(self, start: float, end: float, key_uri: Optional[str] = None) -> str:
+        """Synthesise a VOD playlist for the time window [start, end)."""
+        first, last = self.window(start, end)
+        return self.dumps(key_uri, first, last, playlist_type="VOD")
+
+    # ---------- binary sidecar ----------
+    @staticmethod
+    def sidecar_path(path) -> Path:
+        path = Path(path)
+        return path.parent / SIDECAR_DIR / (path.name + ".idx")
+
+    def to_bytes(self, src_mtime_ns: int, src_size: int) -> bytes:
+        meta = json.dumps({
+            "byteorder": sys.byteorder,
+            "version": self.version,
+            "target_duration": self.target_duration,
+            "media_sequence": self.media_sequence,
+            "playlist_type": self.playlist_type,
+            "endlist": self.endlist,
+            "header": self.header,
+            "footer": self.footer,
+            "uris": self.uris,
+            "key_tags": self.key_tags,
+            "seg_tags": {str(k): v for k, v in self.seg_tags.items()},
+            "titles": {str(k): v for k, v in self.titles.items()},
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return b"".join([
+            SIDECAR_MAGIC,
+            _SIDECAR_HEAD.pack(src_mtime_ns, src_size, len(self.uris), len(meta)),
+            meta,
+            self.durations.tobytes(),
+            self.offsets.tobytes(),
+            self.sizes.tobytes(),
+            self.key_idx.tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Tuple[int, int, "Playlist"]:
+        """Returns (src_mtime_ns, src_size, playlist); ValueError on a corrupt sidecar."""
+        if not data.startswith(SIDECAR_MAGIC):
+            raise ValueError("not a playlist sidecar")
+        pos = len(SIDECAR_MAGIC)
+        mtime_ns, size, n, meta_len = _SIDECAR_HEAD.unpack_from(data, pos)
+        pos += _SIDECAR_HEAD.size
+        meta = json.loads(data[pos:pos + meta_len].decode("utf-8"))
+        pos += meta_len
+        pl = cls()
+        pl.version = meta["version"]
+        pl.target_duration = meta["target_duration"]
+        pl.media_sequence = meta["media_sequence"]
+        pl.playlist_type = meta["playlist_type"]
+        pl.endlist = meta["endlist"]
+        pl.header = meta["header"]
+        pl.footer = meta["footer"]
+        pl.uris = meta["uris"]
+        pl.key_tags = meta["key_tags"]
+        pl.seg_tags = {int(k): v for k, v in meta["seg_tags"].items()}
+        pl.titles = {int(k): v for k, v in meta["titles"].items()}
+        for arr in (pl.durations, pl.offsets, pl.sizes, pl.key_idx):
+            nbytes = n * arr.itemsize
+            chunk = data[pos:pos + nbytes]
+            if len(chunk) != nbytes:
+                raise ValueError("truncated playlist sidecar")
+            arr.frombytes(chunk)
+            if meta["byteorder"] != sys.byteorder:
+                arr.byteswap()
+            pos += nbytes
+        if len(pl.uris) != n:
+            raise ValueError("playlist sidecar segment count mismatch")
+        return mtime_ns, size, pl
+
+    def save_sidecar(self, path) -> bool:
+        """Write the sidecar for playlist `path` (best effort; False if the dir is read-only)."""
+        path = Path(path)
+        try:
+            st = path.stat()
+            side = self.sidecar_path(path)
+            side.parent.mkdir(exist_ok=True)
+            tmp = side.with_name(side.name + f".{os.getpid()}.tmp")
+            tmp.write_bytes(self.to_bytes(st.st_mtime_ns, st.st_size))
+            os.replace(tmp, side)
+            return True
+        except OSError:
+            return False
+
+    @classmethod
+    def load_cached(cls, path, fill_sizes: bool = False, write: bool = True) -> "Playlist":
+        """
+        Load `path` from its sidecar when the sidecar matches the playlist's
+        mtime/size, otherwise parse the text (optionally stat segment sizes)
+        and refresh the sidecar.
+        """
+        path = Path(path)
+        st = path.stat()
+        try:
+            mtime_ns, size, pl = cls.from_bytes(cls.sidecar_path(path).read_bytes())
+            if (mtime_ns, size) == (st.st_mtime_ns, st.st_size) and (pl.sizes_known or not fill_sizes):
+                return pl
+        except (OSError, ValueError, KeyError, struct.error):
+            pass
+        pl = cls.load(path)
+        if fill_sizes:
+            pl.fill_sizes(path.parent)
+        if write:
+            pl.save_sidecar(path)
+        return pl
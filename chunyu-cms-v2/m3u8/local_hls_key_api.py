@@ -9,6 +9,27 @@ Local HLS server + Key API (no extra deps).
     GET /keys/enc.key?token=YOURTOKEN
 - Optional: rewrite m3u8 on-the-fly so EXT-X-KEY URI points to local key API
   (use --rewrite-key-uri)
+- Metrics (Prometheus text format, or JSON with ?format=json):
+    GET /metrics
+  request counts by route/status, bytes sent, in-flight connections,
+  per-route latency histograms and cache hit rates.
+- Clip playlists for a time window of an asset:
+    GET /hls/<asset_id>/<playlist>.m3u8?start=600&end=900
+  built from a cached per-playlist segment index (invalidated by mtime)
+- Optional origin-pull proxy mode (--upstream URL): files missing under --root
+  are fetched from <upstream>/hls/<asset_id>/..., streamed to the client and
+  kept in a size-bounded on-disk LRU cache (--cache-dir, --cache-max-mb);
+  concurrent misses for the same object share one upstream fetch
+- Optional segment read-ahead (--readahead K): when seg_N.ts is served,
+  seg_N+1..N+K are hinted to the OS (posix_fadvise WILLNEED) or preloaded
+  into a bounded memory cache; hit rates show up under /metrics
+- Optional pre-fork mode (--workers N, POSIX only): N processes share the
+  listening port via SO_REUSEPORT; /metrics aggregates all workers.
+  SIGHUP to the master = graceful reload, SIGTERM/Ctrl+C = graceful shutdown.
+  Workers that die right after starting are restarted with backoff; the
+  master exits after repeated crashes or if the port is already taken
+- Access log is structured (one JSON object per line) and written by a
+  background thread, never on the request path (--access-log FILE, default stderr)
 
 Usage (PowerShell):
   python local_hls_key_api.py --root .\output --key .\enc.key --port 8080 --rewrite-key-uri
@@ -20,15 +41,37 @@ Then open in VLC:
 from __future__ import annotations
 
 import argparse
+import json
+import logging
+import logging.handlers
+import math
 import mimetypes
 import os
+import queue
 import re
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from urllib.parse import urlparse, parse_qs, unquote
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse, parse_qs, quote, unquote
+from urllib.request import Request, urlopen
 
-# HLS key tag regex
-KEY_LINE_RE = re.compile(r'(#EXT-X-KEY:.*?URI=")([^"]+)(".*)', re.IGNORECASE)
+from hls_playlist import SIDECAR_DIR, MasterPlaylistError, Playlist, rewrite_key_uri
+
+# Segment filename -> (prefix, number, suffix), e.g. seg_00042.ts
+SEGMENT_NUM_RE = re.compile(r"^(.*?)(\d+)(\.ts)$", re.IGNORECASE)
+
+# Latency histogram bucket upper bounds (seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
 
 def guess_type(path: str) -> str:
@@ -36,34 +79,839 @@ def guess_type(path: str) -> str:
     return ctype or "application/octet-stream"
 
 
+def classify_route(path: str) -> str:
+    """Map a request path to a low-cardinality route label for metrics."""
+    if path.startswith("/hls/"):
+        low = path.lower()
+        if low.endswith(".m3u8"):
+            return "hls_playlist"
+        if low.endswith(".ts"):
+            return "hls_segment"
+        return "hls_other"
+    if path.startswith("/keys/"):
+        return "keys"
+    if path == "/metrics":
+        return "metrics"
+    if path == "/" or path == "":
+        return "index"
+    return "other"
+
+
+# -----------------------------
+# metrics
+# -----------------------------
+class ServerMetrics:
+    """
+    Thread-safe in-process counters for the HLS/key server.
+
+    Caches register a stats callable via register_cache(); it must return a
+    dict with at least "hits" and "misses".
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.buckets = tuple(buckets)
+        self.requests: Dict[Tuple[str, int], int] = {}
+        self.bytes_sent: Dict[str, int] = {}
+        # route -> [bucket counts..., +Inf count], sum
+        self.latency_counts: Dict[str, List[int]] = {}
+        self.latency_sum: Dict[str, float] = {}
+        self.in_flight = 0
+        self._caches: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+    def register_cache(self, name: str, stats_fn: Callable[[], Dict[str, int]]) -> None:
+        self._caches[name] = stats_fn
+
+    def connection_opened(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def connection_closed(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe(self, route: str, status: int, nbytes: int, seconds: float) -> None:
+        with self._lock:
+            key = (route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes_sent[route] = self.bytes_sent.get(route, 0) + nbytes
+            counts = self.latency_counts.get(route)
+            if counts is None:
+                counts = self.latency_counts[route] = [0] * (len(self.buckets) + 1)
+            for i, upper in enumerate(self.buckets):
+                if seconds <= upper:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.latency_sum[route] = self.latency_sum.get(route, 0.0) + seconds
+
+    def snapshot(self) -> dict:
+        """JSON-serialisable view of all metrics (also used to merge workers)."""
+        with self._lock:
+            snap = {
+                "uptime_sec": round(time.time() - self.started_at, 3),
+                "in_flight_connections": self.in_flight,
+                "requests": [
+                    {"route": r, "status": st, "count": c}
+                    for (r, st), c in sorted(self.requests.items())
+                ],
+                "bytes_sent": dict(self.bytes_sent),
+                "latency": {
+                    r: {
+                        "buckets": list(self.buckets),
+                        "counts": list(counts),
+                        "sum": round(self.latency_sum.get(r, 0.0), 6),
+                        "count": sum(counts),
+                    }
+                    for r, counts in self.latency_counts.items()
+                },
+            }
+        caches = {}
+        for name, fn in self._caches.items():
+            st = dict(fn())
+            total = st.get("hits", 0) + st.get("misses", 0)
+            st["hit_rate"] = round(st.get("hits", 0) / total, 4) if total else 0.0
+            caches[name] = st
+        snap["caches"] = caches
+        return snap
+
+
+def merge_snapshots(snaps: List[dict]) -> dict:
+    """Sum metrics snapshots from several worker processes into one."""
+    requests: Dict[Tuple[str, int], int] = {}
+    bytes_sent: Dict[str, int] = {}
+    latency: Dict[str, dict] = {}
+    caches: Dict[str, Dict[str, int]] = {}
+    for snap in snaps:
+        for item in snap.get("requests", []):
+            key = (item["route"], item["status"])
+            requests[key] = requests.get(key, 0) + item["count"]
+        for route, n in snap.get("bytes_sent", {}).items():
+            bytes_sent[route] = bytes_sent.get(route, 0) + n
+        for route, h in snap.get("latency", {}).items():
+            agg = latency.get(route)
+            if agg is None:
+                latency[route] = {"buckets": list(h["buckets"]), "counts": list(h["counts"]),
+                                  "sum": h["sum"], "count": h["count"]}
+                continue
+            agg["counts"] = [a + b for a, b in zip(agg["counts"], h["counts"])]
+            agg["sum"] = round(agg["sum"] + h["sum"], 6)
+            agg["count"] += h["count"]
+        for name, st in snap.get("caches", {}).items():
+            agg_c = caches.setdefault(name, {})
+            for k, v in st.items():
+                if k != "hit_rate" and isinstance(v, (int, float)):
+                    agg_c[k] = agg_c.get(k, 0) + v
+    for st in caches.values():
+        total = st.get("hits", 0) + st.get("misses", 0)
+        st["hit_rate"] = round(st.get("hits", 0) / total, 4) if total else 0.0
+    return {
+        "workers": len(snaps),
+        "uptime_sec": max((s.get("uptime_sec", 0.0) for s in snaps), default=0.0),
+        "in_flight_connections": sum(s.get("in_flight_connections", 0) for s in snaps),
+        "requests": [{"route": r, "status": st, "count": c} for (r, st), c in sorted(requests.items())],
+        "bytes_sent": bytes_sent,
+        "latency": latency,
+        "caches": caches,
+    }
+
+
+def render_prometheus(snap: dict) -> str:
+    """Render a metrics snapshot in Prometheus text exposition format."""
+    out: List[str] = []
+    out.append("# TYPE hls_uptime_seconds gauge")
+    out.append(f"hls_uptime_seconds {snap['uptime_sec']}")
+    if "workers" in snap:
+        out.append("# TYPE hls_workers gauge")
+        out.append(f"hls_workers {snap['workers']}")
+    out.append("# TYPE hls_in_flight_connections gauge")
+    out.append(f"hls_in_flight_connections {snap['in_flight_connections']}")
+
+    out.append("# TYPE hls_requests_total counter")
+    for item in snap["requests"]:
+        out.append(f'hls_requests_total{{route="{item["route"]}",status="{item["status"]}"}} {item["count"]}')
+
+    out.append("# TYPE hls_bytes_sent_total counter")
+    for route, n in sorted(snap["bytes_sent"].items()):
+        out.append(f'hls_bytes_sent_total{{route="{route}"}} {n}')
+
+    out.append("# TYPE hls_request_duration_seconds histogram")
+    for route, h in sorted(snap["latency"].items()):
+        cum = 0
+        for upper, c in zip(h["buckets"], h["counts"]):
+            cum += c
+            out.append(f'hls_request_duration_seconds_bucket{{route="{route}",le="{upper}"}} {cum}')
+        out.append(f'hls_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {h["count"]}')
+        out.append(f'hls_request_duration_seconds_sum{{route="{route}"}} {h["sum"]}')
+        out.append(f'hls_request_duration_seconds_count{{route="{route}"}} {h["count"]}')
+
+    if snap.get("caches"):
+        out.append("# TYPE hls_cache_hits_total counter")
+        out.append("# TYPE hls_cache_misses_total counter")
+        out.append("# TYPE hls_cache_hit_ratio gauge")
+        for name, st in sorted(snap["caches"].items()):
+            out.append(f'hls_cache_hits_total{{cache="{name}"}} {st.get("hits", 0)}')
+            out.append(f'hls_cache_misses_total{{cache="{name}"}} {st.get("misses", 0)}')
+            out.append(f'hls_cache_hit_ratio{{cache="{name}"}} {st["hit_rate"]}')
+    return "\n".join(out) + "\n"
+
+
+# -----------------------------
+# playlist segment index / clipping
+# -----------------------------
+class PlaylistIndexCache:
+    """
+    Bounded in-memory LRU of parsed playlists keyed by path, invalidated by
+    mtime/size. Misses load the binary sidecar (hls_playlist) before falling
+    back to parsing the text.
+
+    rewritten() keeps a second LRU of full playlists with the key URI
+    rewritten in the original text (titles, unknown tags and master
+    playlists pass through untouched), so serving a whole playlist is a
+    stat() plus a dict lookup instead of read + regex per request.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[int, int, Playlist]]" = OrderedDict()
+        # path -> (mtime_ns, size, key_uri, body)
+        self._texts: "OrderedDict[str, Tuple[int, int, str, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.text_hits = 0
+        self.text_misses = 0
+
+    def get(self, path: Path) -> Playlist:
+        st = path.stat()
+        key = str(path)
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        idx = Playlist.load_cached(path)
+        with self._lock:
+            self._items[key] = (st.st_mtime_ns, st.st_size, idx)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return idx
+
+    def rewritten(self, path: Path, key_uri: str) -> bytes:
+        st = path.stat()
+        key = str(path)
+        with self._lock:
+            entry = self._texts.get(key)
+            if entry is not None and entry[:3] == (st.st_mtime_ns, st.st_size, key_uri):
+                self._texts.move_to_end(key)
+                self.text_hits += 1
+                return entry[3]
+            self.text_misses += 1
+        text = path.read_text(encoding="utf-8", errors="replace")
+        body = rewrite_key_uri(text, key_uri).encode("utf-8")
+        with self._lock:
+            self._texts[key] = (st.st_mtime_ns, st.st_size, key_uri, body)
+            self._texts.move_to_end(key)
+            while len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+        return body
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._items)}
+
+    def text_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.text_hits, "misses": self.text_misses, "entries": len(self._texts)}
+
+
+# -----------------------------
+# origin-pull caching proxy
+# -----------------------------
+class _Fill:
+    """One in-progress upstream fetch; followers wait on `event`."""
+
+    __slots__ = ("event", "status", "path")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = 0
+        self.path: Optional[Path] = None
+
+
+class OriginPullCache:
+    """
+    Fetches objects missing locally from an upstream bucket URL laid out like
+    GCS_PUBLIC_URL_PREFIX (<upstream>/hls/<asset_id>/<file>) and keeps them in
+    cache_dir/<asset_id>/<file>, evicting least-recently-used files to stay
+    under max_bytes.
+
+    Concurrent misses for one object are coalesced: the first request (leader)
+    streams the body to its client while writing the cache file; the others
+    wait for it to finish (up to fill_timeout, independent of the per-read
+    upstream timeout) and are then served from disk.
+
+    Playlist sidecars (<asset>/.hlsidx/) are not cache entries: they are
+    skipped by the startup scan and removed together with their playlist.
+
+    The LRU index is per process (rebuilt from mtimes at startup), so with
+    --workers the size bound is approximate.
+    """
+
+    CHUNK = 256 * 1024
+
+    def __init__(self, upstream: str, cache_dir: Path, max_bytes: int, base_dir: str = "hls",
+                 timeout: float = 30.0, playlist_ttl: float = 60.0, fill_timeout: float = 600.0):
+        self.upstream = upstream.rstrip("/")
+        self.base_dir = base_dir.strip("/")
+        self.cache_dir = cache_dir.resolve()
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.fill_timeout = fill_timeout
+        self.playlist_ttl = playlist_ttl
+        self._lock = threading.Lock()
+        self._fills: Dict[str, _Fill] = {}
+        # path -> size, oldest first
+        self._lru: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_errors = 0
+        self.evictions = 0
+        self.bytes_fetched = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        files = []
+        for p in self.cache_dir.rglob("*"):
+            if not p.is_file() or SIDECAR_DIR in p.relative_to(self.cache_dir).parts:
+                continue
+            if ".part" in p.name:
+                p.unlink(missing_ok=True)  # left over from a crash
+                continue
+            st = p.stat()
+            files.append((st.st_mtime, str(p), st.st_size))
+        for _, key, size in sorted(files):
+            self._lru[key] = size
+            self._bytes += size
+
+    def local_path(self, rel: str) -> Optional[Path]:
+        """Cache path for rel, or None if it would escape cache_dir."""
+        p = (self.cache_dir / rel).resolve()
+        try:
+            p.relative_to(self.cache_dir)
+        except ValueError:
+            return None
+        return p
+
+    def lookup(self, path: Path) -> bool:
+        """True if path is cached (and fresh, for playlists); records hit/miss."""
+        key = str(path)
+        with self._lock:
+            cached = key in self._lru
+        if cached and path.suffix.lower() == ".m3u8":
+            try:
+                cached = time.time() - path.stat().st_mtime < self.playlist_ttl
+            except OSError:
+                cached = False
+        elif cached:
+            cached = path.is_file()
+        with self._lock:
+            if cached:
+                self._lru.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        return cached
+
+    def fetch(self, rel: str, path: Path, sink=None) -> Tuple[int, bool]:
+        """
+        Fill `path` from upstream. Returns (status, streamed): streamed=True
+        means the body was already written to `sink` (sink.begin / sink.write).
+        """
+        key = str(path)
+        with self._lock:
+            fill = self._fills.get(key)
+            leader = fill is None
+            if leader:
+                fill = self._fills[key] = _Fill()
+            else:
+                self.coalesced += 1
+        if not leader:
+            # a large object can take longer than one socket timeout: keep waiting
+            # while the leader is still downloading, up to fill_timeout in total
+            deadline = time.monotonic() + self.fill_timeout
+            while not fill.event.wait(min(self.timeout, max(0.0, deadline - time.monotonic()))):
+                if time.monotonic() >= deadline:
+                    break
+            return (fill.status or 504), False
+
+        try:
+            status, streamed = self._download(rel, path, sink)
+            fill.status = status
+            return status, streamed
+        finally:
+            fill.event.set()
+            with self._lock:
+                self._fills.pop(key, None)
+
+    def _download(self, rel: str, path: Path, sink) -> Tuple[int, bool]:
+        url = f"{self.upstream}/{self.base_dir}/{quote(rel)}"
+        part = path.with_name(f"{path.name}.part{os.getpid()}_{threading.get_ident()}")
+        streamed = False
+        try:
+            with urlopen(Request(url, headers={"User-Agent": "LocalHLSKeyAPI-proxy/1.0"}), timeout=self.timeout) as resp:
+                length = resp.headers.get("Content-Length")
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if sink is not None:
+                    sink.begin(int(length) if length else None)
+                    streamed = True
+                size = 0
+                with part.open("wb") as f:
+                    while True:
+                        chunk = resp.read(self.CHUNK)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        size += len(chunk)
+                        if sink is not None:
+                            sink.write(chunk)
+                os.replace(part, path)
+        except HTTPError as e:
+            with self._lock:
+                self.upstream_errors += 1
+            return e.code, streamed
+        except (URLError, OSError):
+            part.unlink(missing_ok=True)
+            with self._lock:
+                self.upstream_errors += 1
+            return 502, streamed
+
+        with self._lock:
+            self.bytes_fetched += size
+            old = self._lru.pop(str(path), None)
+            if old is not None:
+                self._bytes -= old
+            self._lru[str(path)] = size
+            self._bytes += size
+            victims = []
+            for vkey in list(self._lru):
+                if self._bytes <= self.max_bytes:
+                    break
+                if vkey == str(path) or vkey in self._fills:
+                    continue
+                self._bytes -= self._lru.pop(vkey)
+                self.evictions += 1
+                victims.append(vkey)
+        for vkey in victims:
+            try:
+                os.unlink(vkey)
+            except OSError:
+                pass
+            if vkey.lower().endswith(".m3u8"):
+                Playlist.sidecar_path(vkey).unlink(missing_ok=True)
+        return 200, streamed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "upstream_errors": self.upstream_errors,
+                "evictions": self.evictions,
+                "bytes_fetched": self.bytes_fetched,
+                "cached_files": len(self._lru),
+                "cached_bytes": self._bytes,
+            }
+
+
+class _ClientSink:
+    """Streams an upstream body to the client; keeps going if the client drops."""
+
+    def __init__(self, handler: "HLSKeyHandler", path: Path):
+        self.handler = handler
+        self.path = path
+        self.broken = False
+
+    def begin(self, length: Optional[int]) -> None:
+        h = self.handler
+        h.send_response(200)
+        h.send_header("Content-Type", h.guess_type(str(self.path)))
+        if length is not None:
+            h.send_header("Content-Length", str(length))
+        h.end_headers()
+
+    def write(self, chunk: bytes) -> None:
+        if self.broken:
+            return
+        try:
+            self.handler.wfile.write(chunk)
+        except OSError:
+            # client went away; finish filling the cache anyway
+            self.broken = True
+
+
+# -----------------------------
+# segment read-ahead
+# -----------------------------
+class SegmentReadAhead:
+    """
+    Read-ahead for sequential HLS playback.
+
+    After segment N of an asset is served, segments N+1..N+depth are warmed
+    in the background, either with posix_fadvise(WILLNEED) ("fadvise") or by
+    loading them into a byte-bounded LRU cache ("memory"). "auto" picks
+    fadvise where the OS supports it (not on Windows).
+
+    In memory mode a hit means the bytes were served from the cache; in
+    fadvise mode it means the requested segment had been hinted beforehand.
+    """
+
+    def __init__(self, depth: int, mode: str = "auto", cache_mb: int = 256, workers: int = 2):
+        if mode == "auto":
+            mode = "fadvise" if hasattr(os, "posix_fadvise") else "memory"
+        if mode == "fadvise" and not hasattr(os, "posix_fadvise"):
+            raise ValueError("posix_fadvise is not available on this platform; use --readahead-mode memory")
+        self.depth = depth
+        self.mode = mode
+        self.max_bytes = cache_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        # path -> (mtime_ns, size, data)
+        self._cache: "OrderedDict[str, Tuple[int, int, bytes]]" = OrderedDict()
+        self._cache_bytes = 0
+        # fadvise mode: recently hinted paths (bounded)
+        self._hinted: "OrderedDict[str, None]" = OrderedDict()
+        self._pending: set = set()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="readahead")
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evictions = 0
+
+    def lookup(self, path: Path) -> Optional[bytes]:
+        """Return cached bytes for a segment (memory mode), recording hit/miss."""
+        key = str(path)
+        with self._lock:
+            if self.mode == "fadvise":
+                if key in self._hinted:
+                    del self._hinted[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                return None
+            entry = self._cache.get(key)
+        if entry is not None:
+            try:
+                st = path.stat()
+            except OSError:
+                st = None
+            if st is not None and (st.st_mtime_ns, st.st_size) == entry[:2]:
+                with self._lock:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                return entry[2]
+            with self._lock:
+                self._drop(key)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def schedule(self, path: Path) -> None:
+        """Warm the next `depth` segments after `path` in the background."""
+        m = SEGMENT_NUM_RE.match(path.name)
+        if not m or self.depth <= 0:
+            return
+        prefix, num, suffix = m.group(1), m.group(2), m.group(3)
+        n = int(num)
+        for i in range(1, self.depth + 1):
+            nxt = path.with_name(f"{prefix}{n + i:0{len(num)}d}{suffix}")
+            key = str(nxt)
+            with self._lock:
+                if key in self._pending or key in self._cache or key in self._hinted:
+                    continue
+                self._pending.add(key)
+            self._pool.submit(self._prefetch, nxt)
+
+    def _prefetch(self, path: Path) -> None:
+        key = str(path)
+        try:
+            if self.mode == "fadvise":
+                fd = os.open(key, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)  # type: ignore[attr-defined]
+                finally:
+                    os.close(fd)
+                with self._lock:
+                    self._hinted[key] = None
+                    while len(self._hinted) > 4096:
+                        self._hinted.popitem(last=False)
+                    self.prefetched += 1
+                return
+
+            st = path.stat()
+            if st.st_size > self.max_bytes:
+                return
+            data = path.read_bytes()
+            with self._lock:
+                self._drop(key)
+                self._cache[key] = (st.st_mtime_ns, st.st_size, data)
+                self._cache_bytes += len(data)
+                self.prefetched += 1
+                while self._cache_bytes > self.max_bytes and self._cache:
+                    _, (_, _, old) = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(old)
+                    self.evictions += 1
+        except OSError:
+            # Past the last segment, or the file vanished; nothing to warm
+            pass
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _drop(self, key: str) -> None:
+        # caller holds self._lock
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cache_bytes -= len(old[2])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefetched": self.prefetched,
+                "evictions": self.evictions,
+                "cached_items": len(self._cache),
+                "cached_bytes": self._cache_bytes,
+            }
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class MetricsPublisher:
+    """
+    Pre-fork mode: each worker periodically writes its metrics snapshot to
+    <metrics_dir>/worker_<id>.json; /metrics in any worker merges them all
+    (its own snapshot is always taken live).
+    """
+
+    def __init__(self, metrics: ServerMetrics, metrics_dir: Path, worker_id: int, interval: float = 1.0):
+        self.metrics = metrics
+        self.metrics_dir = metrics_dir
+        self.path = metrics_dir / f"worker_{worker_id}.json"
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+
+    def start(self) -> None:
+        self.publish()
+        self._thread.start()
+
+    def publish(self) -> None:
+        tmp = self.path.with_suffix(".json.tmp")
+        try:
+            tmp.write_text(json.dumps(self.metrics.snapshot()), encoding="utf-8")
+            tmp.replace(self.path)
+        except OSError:
+            pass
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.publish()
+
+    def collect(self, own: dict) -> List[dict]:
+        snaps = [own]
+        for p in sorted(self.metrics_dir.glob("worker_*.json")):
+            if p == self.path:
+                continue
+            try:
+                snaps.append(json.loads(p.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return snaps
+
+    def stop(self, remove: bool = True) -> None:
+        self._stop.set()
+        self.publish()
+        if remove:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+class HLSServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that can share its port with sibling workers."""
+
+    reuse_port = False
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)  # type: ignore[attr-defined]
+        super().server_bind()
+
+
+class _CountingWriter:
+    """Wraps the handler's wfile and counts bytes written; drops bodies of HEAD responses."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.count = 0
+        self.discard = False
+
+    def write(self, b) -> int:
+        if self.discard:
+            return len(b)
+        n = self._raw.write(b)
+        self.count += len(b) if n is None else n
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+# -----------------------------
+# access log (buffered, off the request path)
+# -----------------------------
+def setup_access_logger(log_file: str) -> Tuple[logging.Logger, logging.handlers.QueueListener]:
+    """
+    Request threads only enqueue records (QueueHandler); a background
+    QueueListener thread formats them and does the actual I/O.
+    """
+    if log_file:
+        target: logging.Handler = logging.FileHandler(log_file, encoding="utf-8")
+    else:
+        target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(logging.Formatter("%(message)s"))
+
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    logger = logging.getLogger("hls_access")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.handlers[:] = [logging.handlers.QueueHandler(q)]
+
+    listener = logging.handlers.QueueListener(q, target, respect_handler_level=False)
+    listener.start()
+    return logger, listener
+
+
 class HLSKeyHandler(SimpleHTTPRequestHandler):
     """
     Routes:
       /hls/<...>  -> static file from root
       /keys/enc.key -> key bytes (optional token check)
+      /metrics    -> server metrics (Prometheus text, or ?format=json)
       /           -> simple index
     """
 
     server_version = "LocalHLSKeyAPI/1.0"
 
+    def setup(self):
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+        self.server.metrics.connection_opened()  # type: ignore[attr-defined]
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.server.metrics.connection_closed()  # type: ignore[attr-defined]
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def log_request(self, code="-", size="-"):
+        # Per-request logging happens in handle_one_request (structured, buffered)
+        pass
+
+    def handle_one_request(self):
+        # Metrics + access log for every request, whatever the method or outcome:
+        # GET/HEAD/OPTIONS, malformed requests (400), unsupported methods (501), ...
+        self._status = 0
+        self._t0: Optional[float] = None
+        self.path = ""  # not carried over from the previous keep-alive request
+        self.wfile.discard = False
+        bytes0 = self.wfile.count
+        try:
+            super().handle_one_request()
+        finally:
+            if self._status:
+                t0 = self._t0 if self._t0 is not None else time.perf_counter()
+                self._record_request(t0, self.wfile.count - bytes0)
+
+    def parse_request(self):
+        # the request line has been read: start the clock here so keep-alive idle time is not counted
+        self._t0 = time.perf_counter()
+        return super().parse_request()
+
+    def _record_request(self, t0: float, nbytes: int) -> None:
+        elapsed = time.perf_counter() - t0
+        path = urlparse(getattr(self, "path", "") or "").path
+        route = classify_route(path) if path else "other"  # no path: request line did not parse
+        self.server.metrics.observe(route, self._status, nbytes, elapsed)  # type: ignore[attr-defined]
+        logger = getattr(self.server, "access_logger", None)
+        if logger is not None:
+            logger.info(json.dumps({
+                "ts": self.log_date_time_string(),
+                "client": self.client_address[0],
+                "method": getattr(self, "command", "") or "",
+                "path": path,
+                "route": route,
+                "status": self._status,
+                "bytes": nbytes,
+                "duration_ms": round(elapsed * 1000, 3),
+            }, ensure_ascii=False))
+
+    def log_message(self, format, *args):
+        logger = getattr(self.server, "access_logger", None)
+        if logger is None:
+            return super().log_message(format, *args)
+        logger.info(json.dumps({
+            "ts": self.log_date_time_string(),
+            "client": self.address_string(),
+            "event": "message",
+            "message": format % args,
+        }, ensure_ascii=False))
+
     def end_headers(self):
         # CORS (helps with hls.js in browser)
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Headers", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS")
         super().end_headers()
+        if self.command == "HEAD":
+            self.wfile.discard = True
 
     def do_OPTIONS(self):
         self.send_response(204)
         self.end_headers()
 
     def do_GET(self):
-        parsed = urlparse(self.path)
+        self._dispatch(urlparse(self.path))
+
+    def do_HEAD(self):
+        # same routing/status/headers as GET; end_headers() switches the body off
+        self._dispatch(urlparse(self.path))
+
+    def _dispatch(self, parsed):
         path = parsed.path
 
         if path == "/" or path == "":
             return self._serve_index()
 
+        if path == "/metrics":
+            return self._serve_metrics(parsed)
+
         if path.startswith("/keys/enc.key"):
             return self._serve_key(parsed)
 
@@ -76,9 +924,12 @@ class HLSKeyHandler(SimpleHTTPRequestHandler):
         body = (
             "Local HLS + Key API is running.\n\n"
             "HLS files:\n"
-            "  GET /hls/<asset_id>/<playlist>.m3u8\n\n"
+            "  GET /hls/<asset_id>/<playlist>.m3u8\n"
+            "  GET /hls/<asset_id>/<playlist>.m3u8?start=<sec>&end=<sec>   (clip)\n\n"
             "Key API:\n"
-            "  GET /keys/enc.key\n"
+            "  GET /keys/enc.key\n\n"
+            "Metrics:\n"
+            "  GET /metrics[?format=json]\n"
         ).encode("utf-8")
         self.send_response(200)
         self.send_header("Content-Type", "text/plain; charset=utf-8")
@@ -86,6 +937,26 @@ class HLSKeyHandler(SimpleHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(body)
 
+    def _serve_metrics(self, parsed):
+        qs = parse_qs(parsed.query or "")
+        fmt = (qs.get("format") or [""])[0]
+        snap = self.server.metrics.snapshot()  # type: ignore[attr-defined]
+        publisher: Optional[MetricsPublisher] = getattr(self.server, "metrics_publisher", None)
+        if publisher is not None:
+            snap = merge_snapshots(publisher.collect(snap))
+        if fmt == "json":
+            body = json.dumps(snap, ensure_ascii=False).encode("utf-8")
+            ctype = "application/json; charset=utf-8"
+        else:
+            body = render_prometheus(snap).encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
     def _serve_key(self, parsed):
         qs = parse_qs(parsed.query or "")
         token = (qs.get("token") or [""])[0]
@@ -117,26 +988,46 @@ class HLSKeyHandler(SimpleHTTPRequestHandler):
 
         # Security: prevent escaping root
         try:
-            full_path.relative_to(root.resolve())
+            parts = full_path.relative_to(root.resolve()).parts
         except Exception:
             self.send_error(403, "Forbidden")
             return
-
-        if not full_path.exists() or not full_path.is_file():
-            self.send_error(404, f"File not found: {full_path}")
+        # playlist index sidecars (<asset>/.hlsidx/) are internal, never served
+        if SIDECAR_DIR in parts:
+            self.send_error(404, "Not Found")
             return
 
-        # If it's an m3u8 and rewrite enabled, rewrite EXT-X-KEY URI to local key endpoint
+        if not full_path.is_file():
+            proxy: Optional[OriginPullCache] = getattr(self.server, "origin_pull", None)
+            if proxy is None:
+                self.send_error(404, f"File not found: {full_path}")
+                return
+            cache_path = proxy.local_path(rel)
+            if cache_path is None:
+                self.send_error(403, "Forbidden")
+                return
+            if not proxy.lookup(cache_path):
+                # playlists are materialised first so clip/rewrite can use them
+                sink = None if cache_path.suffix.lower() == ".m3u8" else _ClientSink(self, cache_path)
+                status, streamed = proxy.fetch(rel, cache_path, sink)
+                if streamed:
+                    return
+                if status != 200 or not cache_path.is_file():
+                    self.send_error(404 if status in (403, 404) else 502, f"Upstream status {status}: {rel}")
+                    return
+            full_path = cache_path
+
+        # ?start=&end= on a playlist -> windowed clip from the cached segment index
         rewrite = self.server.rewrite_key_uri  # type: ignore[attr-defined]
+        qs = parse_qs(parsed.query or "")
+        if full_path.suffix.lower() == ".m3u8" and ("start" in qs or "end" in qs):
+            return self._serve_clip(full_path, qs, rewrite)
+
+        # If it's an m3u8 and rewrite enabled, rewrite EXT-X-KEY URI to local key endpoint
         if rewrite and full_path.suffix.lower() in [".m3u8"]:
-            text = full_path.read_text(encoding="utf-8", errors="replace")
             key_uri = self.server.local_key_uri  # type: ignore[attr-defined]
-            # Replace URI in key line(s)
-            def _repl(m):
-                return m.group(1) + key_uri + m.group(3)
-
-            new_text = KEY_LINE_RE.sub(_repl, text)
-            data = new_text.encode("utf-8")
+            cache: PlaylistIndexCache = self.server.playlist_index  # type: ignore[attr-defined]
+            data = cache.rewritten(full_path, key_uri)
             self.send_response(200)
             self.send_header("Content-Type", "application/vnd.apple.mpegurl")
             self.send_header("Content-Length", str(len(data)))
@@ -145,15 +1036,70 @@ class HLSKeyHandler(SimpleHTTPRequestHandler):
             self.wfile.write(data)
             return
 
+        readahead: Optional[SegmentReadAhead] = getattr(self.server, "readahead", None)
+        if readahead is not None and full_path.suffix.lower() == ".ts":
+            # byte-range requests always go to _send_file so the answer (206 + slice)
+            # does not depend on whether the segment happens to be prefetched
+            data = readahead.lookup(full_path) if "Range" not in self.headers else None
+            readahead.schedule(full_path)
+            if data is not None:
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp2t")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Last-Modified", formatdate(full_path.stat().st_mtime, usegmt=True))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
         # Otherwise, use SimpleHTTPRequestHandler static serving (supports Range)
         # Trick: change directory base for this request
         self.path = "/hls/" + rel  # keep for logs
         return self._send_file(full_path)
 
+    def _serve_clip(self, full_path: Path, qs: dict, rewrite: bool):
+        try:
+            start = float((qs.get("start") or ["0"])[0] or 0)
+            end_s = (qs.get("end") or [""])[0]
+            end = float(end_s) if end_s else math.inf
+        except ValueError:
+            self.send_error(400, "start/end must be numbers (seconds)")
+            return
+        # float() accepts nan/inf, which would slip through the comparisons below
+        if not math.isfinite(start) or (end_s and not math.isfinite(end)):
+            self.send_error(400, "start/end must be finite numbers (seconds)")
+            return
+        if start < 0 or end <= start:
+            self.send_error(400, "Invalid window: need 0 <= start < end")
+            return
+
+        cache: PlaylistIndexCache = self.server.playlist_index  # type: ignore[attr-defined]
+        try:
+            idx = cache.get(full_path)
+        except MasterPlaylistError:
+            self.send_error(400, "start/end clipping needs a media playlist, not a master playlist")
+            return
+        if start >= idx.total_duration:
+            self.send_error(400, f"start beyond playlist duration ({idx.total_duration:.3f}s)")
+            return
+
+        key_uri = self.server.local_key_uri if rewrite else None  # type: ignore[attr-defined]
+        data = idx.render_window(start, end, key_uri).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
     def _send_file(self, full_path: Path):
-        # Implement static serving with Range support by delegating to SimpleHTTPRequestHandler internals
-        # We need a filesystem path - simplest: open and send ourselves with range handling
-        # BUT Python's SimpleHTTPRequestHandler has range support via send_head() in newer versions.
+        # Single byte ranges (players seeking inside a segment) are answered here with 206;
+        # SimpleHTTPRequestHandler.send_head() has no Range support
+        rng = self.headers.get("Range")
+        if rng and full_path.is_file():
+            span = parse_byte_range(rng, full_path.stat().st_size)
+            if span is not None:
+                return self._send_file_range(full_path, span)
+        # Everything else: delegate to SimpleHTTPRequestHandler internals.
         # We'll temporarily set self.path to a fake path and use translate_path override.
         self._full_path_override = full_path  # type: ignore[attr-defined]
         try:
@@ -167,6 +1113,34 @@ class HLSKeyHandler(SimpleHTTPRequestHandler):
         finally:
             delattr(self, "_full_path_override")
 
+    def _send_file_range(self, full_path: Path, span: Tuple[int, int]):
+        size = full_path.stat().st_size
+        first, last = span
+        if first >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        last = min(last, size - 1)
+        length = last - first + 1
+        with full_path.open("rb") as f:
+            f.seek(first)
+            self.send_response(206)
+            self.send_header("Content-Type", self.guess_type(str(full_path)))
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Last-Modified", formatdate(full_path.stat().st_mtime, usegmt=True))
+            self.end_headers()
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(256 * 1024, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
     def translate_path(self, path: str) -> str:
         # Override translate_path so send_head() serves our resolved full path
         if hasattr(self, "_full_path_override"):
@@ -182,6 +1156,268 @@ class HLSKeyHandler(SimpleHTTPRequestHandler):
         return guess_type(path)
 
 
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    'bytes=a-b' / 'bytes=a-' / 'bytes=-n' -> (first, last) inclusive, last clamped
+    to the file. None for anything else (multiple ranges, garbage): serve the
+    whole file, as RFC 9110 allows.
+    """
+    m = RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        n = int(m.group(2))
+        if n == 0:
+            return None
+        return max(0, size - n), size - 1
+    first = int(m.group(1))
+    if not m.group(2):
+        return first, max(first, size - 1)  # first >= size -> 416 in the caller
+    last = int(m.group(2))
+    if last < first:
+        return None
+    return first, last
+
+
+def build_server(args, reuse_port: bool = False) -> HLSServer:
+    """Create and configure one server instance (one per worker in pre-fork mode)."""
+    root_dir = Path(args.root).resolve()
+    key_path = Path(args.key).resolve()
+
+    HLSServer.reuse_port = reuse_port
+    httpd = HLSServer((args.host, args.port), HLSKeyHandler)
+    if reuse_port:
+        # let server_close() wait for in-flight requests (graceful shutdown)
+        httpd.daemon_threads = False
+    httpd.root_dir = root_dir  # type: ignore[attr-defined]
+    httpd.key_path = key_path  # type: ignore[attr-defined]
+    httpd.required_token = args.token  # type: ignore[attr-defined]
+    httpd.metrics = ServerMetrics()  # type: ignore[attr-defined]
+    httpd.metrics_publisher = None  # type: ignore[attr-defined]
+    httpd.playlist_index = PlaylistIndexCache()  # type: ignore[attr-defined]
+    httpd.metrics.register_cache("playlist_index", httpd.playlist_index.stats)  # type: ignore[attr-defined]
+    httpd.metrics.register_cache("playlist_rewrite", httpd.playlist_index.text_stats)  # type: ignore[attr-defined]
+
+    readahead = None
+    if args.readahead > 0:
+        readahead = SegmentReadAhead(args.readahead, args.readahead_mode, args.readahead_cache_mb)
+        httpd.metrics.register_cache("segment_readahead", readahead.stats)  # type: ignore[attr-defined]
+    httpd.readahead = readahead  # type: ignore[attr-defined]
+
+    origin_pull = None
+    if args.upstream:
+        origin_pull = OriginPullCache(
+            args.upstream, Path(args.cache_dir), args.cache_max_mb * 1024 * 1024,
+            base_dir=args.upstream_base_dir, playlist_ttl=args.playlist_ttl,
+        )
+        httpd.metrics.register_cache("origin_pull", origin_pull.stats)  # type: ignore[attr-defined]
+    httpd.origin_pull = origin_pull  # type: ignore[attr-defined]
+
+    httpd.access_log_listener = None  # type: ignore[attr-defined]
+    if args.no_access_log:
+        httpd.access_logger = None  # type: ignore[attr-defined]
+    else:
+        access_logger, listener = setup_access_logger(args.access_log)
+        httpd.access_logger = access_logger  # type: ignore[attr-defined]
+        httpd.access_log_listener = listener  # type: ignore[attr-defined]
+
+    httpd.local_key_uri = local_key_uri_for(args)  # type: ignore[attr-defined]
+    httpd.rewrite_key_uri = bool(args.rewrite_key_uri)  # type: ignore[attr-defined]
+    return httpd
+
+
+def close_server(httpd: HLSServer) -> None:
+    httpd.server_close()
+    publisher = getattr(httpd, "metrics_publisher", None)
+    if publisher is not None:
+        publisher.stop()
+    listener = getattr(httpd, "access_log_listener", None)
+    if listener is not None:
+        listener.stop()
+    readahead = getattr(httpd, "readahead", None)
+    if readahead is not None:
+        readahead.close()
+
+
+def local_key_uri_for(args) -> str:
+    # local key URI for rewriting
+    if args.token:
+        return f"http://{args.host}:{args.port}/keys/enc.key?token={args.token}"
+    return f"http://{args.host}:{args.port}/keys/enc.key"
+
+
+# -----------------------------
+# pre-fork workers
+# -----------------------------
+def run_worker(args, worker_id: int, metrics_dir: Path) -> None:
+    """Child process body: serve until SIGTERM, then drain and exit."""
+    httpd = build_server(args, reuse_port=True)
+    publisher = MetricsPublisher(httpd.metrics, metrics_dir, worker_id)  # type: ignore[attr-defined]
+    httpd.metrics_publisher = publisher  # type: ignore[attr-defined]
+    publisher.start()
+
+    def _graceful(signum, frame):
+        # shutdown() blocks until serve_forever() returns -> call from another thread
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _graceful)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master handles Ctrl+C
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        httpd.serve_forever()
+    finally:
+        close_server(httpd)
+
+
+def spawn_worker(args, worker_id: int, metrics_dir: Path) -> int:
+    pid = os.fork()  # type: ignore[attr-defined]
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(args, worker_id, metrics_dir)
+        except BaseException as e:  # never return into the master's code path
+            print(f"worker {worker_id} failed: {e}", file=sys.stderr)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def stop_workers(pids: List[int], timeout: float = 30.0) -> None:
+    """SIGTERM workers, wait for them to drain, SIGKILL stragglers."""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.time() + timeout
+    remaining = set(pids)
+    while remaining and time.time() < deadline:
+        for pid in list(remaining):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                remaining.discard(pid)
+        time.sleep(0.05)
+    for pid in remaining:
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+
+# a worker that dies within this many seconds of starting counts as a crash;
+# crashes are restarted with exponential backoff and the master gives up after
+# WORKER_MAX_CRASHES in a row (e.g. port taken, bad --root/--key)
+WORKER_EARLY_EXIT_SEC = 5.0
+WORKER_BACKOFF_BASE_SEC = 0.5
+WORKER_BACKOFF_MAX_SEC = 30.0
+WORKER_MAX_CRASHES = 5
+
+
+def check_port_free(host: str, port: int) -> None:
+    """Bind (without listening) once in the master so a taken port fails fast instead of crash-looping workers."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    probe = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)  # type: ignore[attr-defined]
+        probe.bind((host, port))
+    except OSError as e:
+        raise SystemExit(f"Cannot bind {host}:{port}: {e}")
+    finally:
+        probe.close()
+
+
+def run_master(args) -> None:
+    """
+    Pre-fork master: keeps N workers alive. Workers bind the same port with
+    SO_REUSEPORT so the kernel load-balances connections across them.
+
+    SIGHUP: graceful reload (start a new generation, then drain the old one)
+    SIGTERM/SIGINT: graceful shutdown
+    """
+    if not hasattr(os, "fork") or not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("--workers needs fork() and SO_REUSEPORT (Linux/macOS); run without --workers on Windows")
+
+    check_port_free(args.host, args.port)
+    metrics_dir = Path(tempfile.mkdtemp(prefix="hls_metrics_"))
+    next_id = 0
+    workers: Dict[int, int] = {}  # pid -> worker_id
+    started: Dict[int, float] = {}  # pid -> start time
+    events: List[str] = []
+    crashes = 0  # consecutive early exits
+    restart_at: List[float] = []  # pending restarts (monotonic deadlines)
+
+    def _start(n: int) -> None:
+        nonlocal next_id
+        for _ in range(n):
+            pid = spawn_worker(args, next_id, metrics_dir)
+            workers[pid] = next_id
+            started[pid] = time.monotonic()
+            next_id += 1
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: events.append("reload"))
+    signal.signal(signal.SIGTERM, lambda signum, frame: events.append("stop"))
+    signal.signal(signal.SIGINT, lambda signum, frame: events.append("stop"))
+
+    _start(args.workers)
+    print(f"  Workers: {args.workers} (master pid {os.getpid()}, SIGHUP to reload)")
+    try:
+        while True:
+            if "stop" in events:
+                break
+            if "reload" in events:
+                events.clear()
+                old = list(workers)
+                restart_at.clear()
+                crashes = 0
+                _start(args.workers)
+                stop_workers(old)
+                for pid in old:
+                    workers.pop(pid, None)
+                print(f"Reloaded: {args.workers} new worker(s)")
+                continue
+            # reap and replace workers that died unexpectedly
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            now = time.monotonic()
+            if pid and pid in workers:
+                wid = workers.pop(pid)
+                uptime = now - started.pop(pid, now)
+                (metrics_dir / f"worker_{wid}.json").unlink(missing_ok=True)
+                if uptime < WORKER_EARLY_EXIT_SEC:
+                    crashes += 1
+                    if crashes >= WORKER_MAX_CRASHES:
+                        print(f"Worker {wid} (pid {pid}) exited after {uptime:.1f}s; "
+                              f"{crashes} crashes in a row, giving up", file=sys.stderr)
+                        raise SystemExit(1)
+                    delay = min(WORKER_BACKOFF_MAX_SEC, WORKER_BACKOFF_BASE_SEC * 2 ** (crashes - 1))
+                else:
+                    crashes = 0
+                    delay = 0.0
+                print(f"Worker {wid} (pid {pid}) exited after {uptime:.1f}s; restarting in {delay:.1f}s",
+                      file=sys.stderr)
+                restart_at.append(now + delay)
+            due = [t for t in restart_at if t <= now]
+            if due:
+                restart_at[:] = [t for t in restart_at if t > now]
+                _start(len(due))
+            time.sleep(0.2)
+    finally:
+        stop_workers(list(workers))
+        for p in metrics_dir.glob("*"):
+            p.unlink(missing_ok=True)
+        metrics_dir.rmdir()
+
+
 def main():
     ap = argparse.ArgumentParser("Local HLS server + Key API")
     ap.add_argument("--root", default="output", help="HLS root folder (default: ./output)")
@@ -191,6 +1427,23 @@ def main():
     ap.add_argument("--token", default="", help="Optional token required for key API")
     ap.add_argument("--rewrite-key-uri", action="store_true",
                     help="Rewrite m3u8 EXT-X-KEY URI to local /keys/enc.key (recommended for local test)")
+    ap.add_argument("--readahead", type=int, default=0,
+                    help="Warm the next K segments after each segment request (default 0 = off)")
+    ap.add_argument("--readahead-mode", choices=["auto", "fadvise", "memory"], default="auto",
+                    help="fadvise: OS page-cache hint; memory: in-process LRU cache (default auto)")
+    ap.add_argument("--readahead-cache-mb", type=int, default=256,
+                    help="Memory cache size for --readahead-mode memory (default 256)")
+    ap.add_argument("--upstream", default="",
+                    help="Origin-pull mode: bucket base URL, e.g. https://storage.googleapis.com/<bucket>")
+    ap.add_argument("--upstream-base-dir", default="hls", help="Base dir under the upstream URL (default: hls)")
+    ap.add_argument("--cache-dir", default="proxy_cache", help="Origin-pull disk cache dir (default: ./proxy_cache)")
+    ap.add_argument("--cache-max-mb", type=int, default=10240, help="Origin-pull disk cache size (default 10240)")
+    ap.add_argument("--playlist-ttl", type=float, default=60.0,
+                    help="Seconds a proxied playlist stays fresh in the cache (default 60)")
+    ap.add_argument("--access-log", default="", help="Access log file (JSON lines; default: stderr)")
+    ap.add_argument("--no-access-log", action="store_true", help="Disable access logging")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="Pre-fork N worker processes sharing the port via SO_REUSEPORT (default 0 = single process)")
     args = ap.parse_args()
 
     root_dir = Path(args.root).resolve()
@@ -200,35 +1453,33 @@ def main():
     if not key_path.exists():
         raise SystemExit(f"Key not found: {key_path}")
 
-    httpd = ThreadingHTTPServer((args.host, args.port), HLSKeyHandler)
-    httpd.root_dir = root_dir  # type: ignore[attr-defined]
-    httpd.key_path = key_path  # type: ignore[attr-defined]
-    httpd.required_token = args.token  # type: ignore[attr-defined]
-
-    # local key URI for rewriting
-    if args.token:
-        local_key_uri = f"http://{args.host}:{args.port}/keys/enc.key?token={args.token}"
-    else:
-        local_key_uri = f"http://{args.host}:{args.port}/keys/enc.key"
-    httpd.local_key_uri = local_key_uri  # type: ignore[attr-defined]
-    httpd.rewrite_key_uri = bool(args.rewrite_key_uri)  # type: ignore[attr-defined]
-
     print("Local HLS + Key API running")
     print(f"  Root: {root_dir}")
     print(f"  Key : {key_path}")
-    print(f"  Key URL (local): {local_key_uri}")
+    print(f"  Key URL (local): {local_key_uri_for(args)}")
     print(f"  Rewrite m3u8 key URI: {args.rewrite_key_uri}")
+    if args.readahead > 0:
+        print(f"  Read-ahead: {args.readahead} segment(s), mode={args.readahead_mode}")
+    if args.upstream:
+        print(f"  Upstream: {args.upstream.rstrip('/')}/{args.upstream_base_dir} "
+              f"(cache: {Path(args.cache_dir).resolve()}, {args.cache_max_mb} MB)")
+    print(f"  Metrics: http://{args.host}:{args.port}/metrics")
     print("")
     print("Play URL format:")
     print("  http://127.0.0.1:8080/hls/<asset_id>/<playlist>.m3u8")
-    print("")
+    print("", flush=True)
+
+    if args.workers > 0:
+        run_master(args)
+        return
 
+    httpd = build_server(args)
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         pass
     finally:
-        httpd.server_close()
+        close_server(httpd)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+hls_playlist.Playlist: parsing, serialisation, windows, keys and the sidecar.
+
+  python -m unittest discover -s tests      (from chunyu-cms-v2/m3u8)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from hls_playlist import MasterPlaylistError, Playlist, parse_key_attrs, rewrite_key_uri  # noqa: E402
+
+# ffmpeg-style output, normalised the way dumps() writes it
+VOD = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:5
+#EXT-X-MEDIA-SEQUENCE:10
+#EXT-X-PLAYLIST-TYPE:VOD
+#EXT-X-INDEPENDENT-SEGMENTS
+#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example/k1",IV=0x01
+#EXTINF:4.000000,Intro
+seg_00000.ts
+#EXTINF:5.000000,
+seg_00001.ts
+#EXT-X-DISCONTINUITY
+#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example/k2",IV=0x02
+#EXTINF:3.500000,
+seg_00002.ts
+#EXTINF:2.000000,
+seg_00003.ts
+#EXT-X-PROGRAM-DATE-TIME:2026-01-01T00:00:14.500Z
+#EXT-X-ENDLIST
+"""
+
+MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
+low/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2400000,RESOLUTION=1280x720
+high/index.m3u8
+"""
+
+
+class ParseTest(unittest.TestCase):
+    def setUp(self):
+        self.pl = Playlist.parse(VOD)
+
+    def test_fields(self):
+        pl = self.pl
+        self.assertEqual(len(pl), 4)
+        self.assertEqual((pl.version, pl.target_duration, pl.media_sequence), (3, 5, 10))
+        self.assertEqual(pl.playlist_type, "VOD")
+        self.assertTrue(pl.endlist)
+        self.assertEqual(list(pl.durations), [4.0, 5.0, 3.5, 2.0])
+        self.assertEqual(list(pl.offsets), [0.0, 4.0, 9.0, 12.5])
+        self.assertEqual(pl.total_duration, 14.5)
+        self.assertEqual(list(pl.key_idx), [0, 0, 1, 1])
+        self.assertEqual(pl.titles, {0: "Intro"})
+        self.assertEqual(pl.seg_tags, {2: ["#EXT-X-DISCONTINUITY"]})
+        self.assertEqual(pl.header, ["#EXT-X-INDEPENDENT-SEGMENTS"])
+        self.assertEqual(pl.footer, ["#EXT-X-PROGRAM-DATE-TIME:2026-01-01T00:00:14.500Z"])
+        self.assertEqual(pl.segment_names(), ["seg_00000.ts", "seg_00001.ts", "seg_00002.ts", "seg_00003.ts"])
+
+    def test_round_trip(self):
+        self.assertEqual(self.pl.dumps(), VOD)
+        self.assertEqual(Playlist.parse(self.pl.dumps()).dumps(), VOD)
+
+    def test_master_playlist_rejected(self):
+        with self.assertRaises(MasterPlaylistError):
+            Playlist.parse(MASTER)
+        self.assertIsInstance(MasterPlaylistError(), ValueError)
+
+    def test_segment_names_strip_path_and_query(self):
+        pl = Playlist.parse("#EXTM3U\n#EXTINF:4,\nhttps://cdn.example/a/seg_00000.ts?sig=x\n")
+        self.assertEqual(pl.segment_names(), ["seg_00000.ts"])
+
+
+class WindowTest(unittest.TestCase):
+    def setUp(self):
+        self.pl = Playlist.parse(VOD)
+
+    def test_window_math(self):
+        pl = self.pl
+        self.assertEqual(pl.window(0, 4), (0, 1))
+        self.assertEqual(pl.window(0, 4.01), (0, 2))
+        self.assertEqual(pl.window(4.5, 9), (1, 2))
+        self.assertEqual(pl.window(9, float("inf")), (2, 4))
+        self.assertEqual(pl.window(14.5, 20), (4, 4))  # empty past the end
+        self.assertEqual(pl.window(100, 200), (4, 4))
+        self.assertEqual(pl.segment_at(0), 0)
+        self.assertEqual(pl.segment_at(12.5), 3)
+        self.assertEqual(pl.segment_at(99), 3)
+
+    def test_render_window_keeps_sequence_and_key(self):
+        out = self.pl.render_window(10, 13)
+        lines = out.splitlines()
+        # media sequence is not renumbered (it is the implicit AES IV)
+        self.assertIn("#EXT-X-MEDIA-SEQUENCE:12", lines)
+        self.assertIn("#EXT-X-TARGETDURATION:4", lines)
+        self.assertIn("#EXT-X-PLAYLIST-TYPE:VOD", lines)
+        # the key in effect for the first segment is re-emitted before it
+        key_pos = lines.index('#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example/k2",IV=0x02')
+        self.assertLess(key_pos, lines.index("seg_00002.ts"))
+        self.assertEqual([l for l in lines if l.endswith(".ts")], ["seg_00002.ts", "seg_00003.ts"])
+        self.assertEqual(lines[-1], "#EXT-X-ENDLIST")
+
+    def test_mid_window_drops_footer(self):
+        out = self.pl.dumps(first=0, last=2)
+        self.assertNotIn("PROGRAM-DATE-TIME", out)
+        self.assertIn("#EXTINF:4.000000,Intro", out)
+
+    def test_key_tags_emitted_once_per_change(self):
+        out = self.pl.dumps()
+        self.assertEqual(out.count("#EXT-X-KEY"), 2)
+
+    def test_key_uri_rewrite(self):
+        out = self.pl.dumps(key_uri="http://127.0.0.1:8080/keys/enc.key")
+        keys = [l for l in out.splitlines() if l.startswith("#EXT-X-KEY")]
+        self.assertEqual([parse_key_attrs(k)["URI"] for k in keys], ["http://127.0.0.1:8080/keys/enc.key"] * 2)
+        self.assertEqual([parse_key_attrs(k)["IV"] for k in keys], ["0x01", "0x02"])
+        self.assertEqual(self.pl.key_for(2)["URI"], "https://keys.example/k2")
+
+    def test_text_rewrite_leaves_everything_else(self):
+        out = rewrite_key_uri(VOD, "K")
+        self.assertEqual(out.replace('URI="K"', "X"), VOD.replace('URI="https://keys.example/k1"', "X")
+                         .replace('URI="https://keys.example/k2"', "X"))
+        self.assertEqual(rewrite_key_uri(MASTER, "K"), MASTER)
+
+
+class SidecarTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp(prefix="hls_playlist_test_"))
+        self.path = self.dir / "playlist_1.m3u8"
+        self.path.write_text(VOD, encoding="utf-8")
+        for i, size in enumerate((100, 200, 300)):
+            (self.dir / f"seg_{i:05d}.ts").write_bytes(b"\0" * size)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_fill_sizes(self):
+        pl = Playlist.load(self.path)
+        self.assertFalse(pl.sizes_known)
+        self.assertEqual(pl.fill_sizes(self.dir), 1)  # seg_00003.ts is missing
+        self.assertEqual(list(pl.sizes), [100, 200, 300, -1])
+        self.assertEqual(pl.total_bytes, 600)
+
+    def test_bytes_round_trip(self):
+        pl = Playlist.load(self.path)
+        pl.fill_sizes(self.dir)
+        mtime_ns, size, back = Playlist.from_bytes(pl.to_bytes(123, 456))
+        self.assertEqual((mtime_ns, size), (123, 456))
+        self.assertEqual(back.dumps(), VOD)
+        self.assertEqual(list(back.sizes), list(pl.sizes))
+        self.assertEqual(list(back.offsets), list(pl.offsets))
+        self.assertEqual(back.titles, pl.titles)
+        self.assertEqual(back.footer, pl.footer)
+
+    def test_load_cached_uses_and_invalidates_sidecar(self):
+        first = Playlist.load_cached(self.path, fill_sizes=True)
+        side = Playlist.sidecar_path(self.path)
+        self.assertEqual(side, self.dir / ".hlsidx" / "playlist_1.m3u8.idx")
+        self.assertTrue(side.is_file())
+        self.assertEqual(list(first.sizes), [100, 200, 300, -1])
+
+        # served from the sidecar: the segment stat() results are not refreshed
+        (self.dir / "seg_00000.ts").write_bytes(b"\0" * 999)
+        self.assertEqual(Playlist.load_cached(self.path).sizes[0], 100)
+
+        # editing the playlist invalidates the sidecar
+        self.path.write_text(VOD.replace("seg_00003.ts", "seg_00004.ts"), encoding="utf-8")
+        st = self.path.stat()
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        again = Playlist.load_cached(self.path)
+        self.assertEqual(again.uris[-1], "seg_00004.ts")
+        self.assertEqual(Playlist.from_bytes(side.read_bytes())[2].uris[-1], "seg_00004.ts")
+
+    def test_corrupt_sidecar_falls_back_to_text(self):
+        side = Playlist.sidecar_path(self.path)
+        side.parent.mkdir()
+        side.write_bytes(b"HLSIDX2\ngarbage")
+        self.assertEqual(Playlist.load_cached(self.path).dumps(), VOD)
+        with self.assertRaises(ValueError):
+            Playlist.from_bytes(b"not a sidecar")
+
+    def test_sidecar_not_written_when_disabled(self):
+        Playlist.load_cached(self.path, write=False)
+        self.assertFalse(Playlist.sidecar_path(self.path).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
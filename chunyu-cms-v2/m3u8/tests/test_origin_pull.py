@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+OriginPullCache against a local upstream HTTP server (stdlib only).
+
+  python -m unittest discover -s tests      (from chunyu-cms-v2/m3u8)
+"""
+
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from hls_playlist import Playlist  # noqa: E402
+from local_hls_key_api import OriginPullCache  # noqa: E402
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    """Serves server.objects[path]; sends the body in `chunks` pieces, `delay` seconds apart."""
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.requests.append(self.path)
+        body = srv.objects.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        step = max(1, len(body) // srv.chunks)
+        for i in range(0, len(body), step):
+            time.sleep(srv.delay)
+            self.wfile.write(body[i:i + step])
+            self.wfile.flush()
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class _Sink:
+    def __init__(self):
+        self.length = None
+        self.data = b""
+
+    def begin(self, length):
+        self.length = length
+
+    def write(self, chunk):
+        self.data += chunk
+
+
+class OriginPullCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.upstream = ThreadingHTTPServer(("127.0.0.1", 0), _Upstream)
+        self.upstream.daemon_threads = True
+        self.upstream.lock = threading.Lock()
+        self.upstream.requests = []
+        self.upstream.objects = {}
+        self.upstream.chunks = 1
+        self.upstream.delay = 0.0
+        threading.Thread(target=self.upstream.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.upstream.server_address[1]}"
+        self.cache_dir = Path(tempfile.mkdtemp(prefix="origin_pull_test_"))
+
+    def tearDown(self):
+        self.upstream.shutdown()
+        self.upstream.server_close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def cache(self, max_bytes=1 << 20, **kw):
+        return OriginPullCache(self.base, self.cache_dir, max_bytes, **kw)
+
+    def test_miss_streams_and_fills_cache(self):
+        self.upstream.objects["/hls/a/seg_00000.ts"] = b"x" * 1000
+        cache = self.cache()
+        path = cache.local_path("a/seg_00000.ts")
+        self.assertFalse(cache.lookup(path))
+        sink = _Sink()
+        self.assertEqual(cache.fetch("a/seg_00000.ts", path, sink), (200, True))
+        self.assertEqual((sink.length, sink.data), (1000, b"x" * 1000))
+        self.assertEqual(path.read_bytes(), b"x" * 1000)
+        self.assertTrue(cache.lookup(path))
+        self.assertEqual(cache.stats()["cached_bytes"], 1000)
+
+    def test_upstream_404(self):
+        cache = self.cache()
+        path = cache.local_path("a/missing.ts")
+        self.assertEqual(cache.fetch("a/missing.ts", path), (404, False))
+        self.assertFalse(path.exists())
+        self.assertEqual(cache.stats()["upstream_errors"], 1)
+
+    def test_local_path_rejects_escape(self):
+        self.assertIsNone(self.cache().local_path("../outside.ts"))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        self.upstream.objects["/hls/a/seg_00001.ts"] = b"y" * 4000
+        self.upstream.chunks = 4
+        self.upstream.delay = 0.1
+        cache = self.cache()
+        path = cache.local_path("a/seg_00001.ts")
+        results = []
+
+        def _get():
+            results.append(cache.fetch("a/seg_00001.ts", path)[0])
+
+        threads = [threading.Thread(target=_get) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [200] * 5)
+        self.assertEqual(self.upstream.requests, ["/hls/a/seg_00001.ts"])
+        self.assertEqual(cache.stats()["coalesced"], 4)
+
+    def test_followers_outlast_socket_timeout(self):
+        # each read completes within `timeout`, the whole fill does not
+        self.upstream.objects["/hls/a/big.ts"] = b"z" * 8000
+        self.upstream.chunks = 8
+        self.upstream.delay = 0.1
+        cache = self.cache(timeout=0.3)
+        path = cache.local_path("a/big.ts")
+        leader = threading.Thread(target=cache.fetch, args=("a/big.ts", path))
+        leader.start()
+        time.sleep(0.05)
+        self.assertEqual(cache.fetch("a/big.ts", path), (200, False))
+        leader.join()
+        self.assertEqual(path.stat().st_size, 8000)
+
+    def test_lru_eviction_removes_playlist_sidecar(self):
+        self.upstream.objects["/hls/a/p.m3u8"] = b"#EXTM3U\n#EXTINF:4.0,\nseg_00000.ts\n#EXT-X-ENDLIST\n"
+        self.upstream.objects["/hls/a/seg_00000.ts"] = b"s" * 600
+        self.upstream.objects["/hls/b/seg_00000.ts"] = b"t" * 600
+        cache = self.cache(max_bytes=1000)
+        pl = cache.local_path("a/p.m3u8")
+        cache.fetch("a/p.m3u8", pl)
+        Playlist.load_cached(pl)
+        self.assertTrue(Playlist.sidecar_path(pl).is_file())
+        time.sleep(0.01)
+        a_seg = cache.local_path("a/seg_00000.ts")
+        cache.fetch("a/seg_00000.ts", a_seg)
+        b_seg = cache.local_path("b/seg_00000.ts")
+        cache.fetch("b/seg_00000.ts", b_seg)
+        # oldest first: playlist, then a's segment had to go to fit b's
+        self.assertFalse(pl.exists())
+        self.assertFalse(Playlist.sidecar_path(pl).exists())
+        self.assertFalse(a_seg.exists())
+        self.assertTrue(b_seg.exists())
+        self.assertEqual(cache.stats()["cached_bytes"], 600)
+
+    def test_startup_scan_ignores_sidecars(self):
+        self.upstream.objects["/hls/a/p.m3u8"] = b"#EXTM3U\n#EXTINF:4.0,\nseg_00000.ts\n#EXT-X-ENDLIST\n"
+        cache = self.cache()
+        pl = cache.local_path("a/p.m3u8")
+        cache.fetch("a/p.m3u8", pl)
+        Playlist.load_cached(pl)
+        restarted = self.cache()
+        self.assertEqual(restarted.stats()["cached_files"], 1)
+        self.assertEqual(restarted.stats()["cached_bytes"], pl.stat().st_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+gcpup.resumable against a minimal fake GCS JSON API (stdlib only).
+
+  python -m unittest discover -s tests      (from chunyu-cms-v2/m3u8)
+"""
+
+import http.client
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "gcpup"))
+
+from resumable import (  # noqa: E402
+    CHUNK_ALIGN, COMPOSE_TMP_PREFIX, ResumableUploadError, upload_composite, upload_resumable,
+)
+
+BUCKET = "test-bucket"
+OBJ_RE = re.compile(r"^/storage/v1/b/([^/]+)/o/([^/]+)(/compose)?$")
+CONTENT_RANGE_RE = re.compile(r"^bytes (?:(\d+)-(\d+)|\*)/(\d+)$")
+
+
+class _FakeGCS(BaseHTTPRequestHandler):
+    """Media, resumable and compose uploads plus DELETE, kept in server.objects."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _reply(self, code, obj=None, headers=None):
+        data = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _store(self, name, data):
+        srv = self.server
+        with srv.lock:
+            srv.objects[name] = bytes(data)
+            srv.uploaded.append(name)
+        return {"bucket": BUCKET, "name": name, "size": str(len(data))}
+
+    def do_POST(self):
+        srv = self.server
+        url = urlsplit(self.path)
+        qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body()
+        m = OBJ_RE.match(url.path)
+        if m and m.group(3):
+            if srv.fail_compose:
+                return self._reply(500, {"error": "compose failed"})
+            sources = [s["name"] for s in json.loads(body)["sourceObjects"]]
+            with srv.lock:
+                srv.composed.append(sources)
+                if any(s not in srv.objects for s in sources):
+                    return self._reply(404, {"error": "source missing"})
+                data = b"".join(srv.objects[s] for s in sources)
+            return self._reply(200, self._store(unquote(m.group(2)), data))
+        if url.path != f"/upload/storage/v1/b/{BUCKET}/o":
+            return self._reply(404)
+        if qs.get("uploadType") == "media":
+            return self._reply(200, self._store(qs["name"], body))
+        if qs.get("uploadType") == "resumable":
+            with srv.lock:
+                sid = str(len(srv.sessions))
+                srv.sessions[sid] = {"name": json.loads(body)["name"], "data": bytearray(),
+                                     "size": int(self.headers["X-Upload-Content-Length"])}
+            host = self.headers["Host"]
+            return self._reply(200, {}, {"Location": f"http://{host}/upload/session/{sid}"})
+        self._reply(400)
+
+    def do_PUT(self):
+        srv = self.server
+        body = self._body()
+        sess = srv.sessions.get(self.path.rsplit("/", 1)[-1])
+        if sess is None:
+            return self._reply(404)
+        first, last, _ = CONTENT_RANGE_RE.match(self.headers["Content-Range"]).groups()
+        if first is not None:
+            with srv.lock:
+                srv.chunk_puts += 1
+                fail = srv.chunk_puts in srv.fail_chunks
+            if fail:
+                return self._reply(503, {"error": "try again"})
+            if int(first) != len(sess["data"]):
+                return self._reply(400, {"error": "bad offset"})
+            sess["data"] += body
+        if len(sess["data"]) >= sess["size"]:
+            return self._reply(200, self._store(sess["name"], sess["data"]))
+        rng = {"Range": f"bytes=0-{len(sess['data']) - 1}"} if sess["data"] else {}
+        self._reply(308, None, rng)
+
+    def do_DELETE(self):
+        srv = self.server
+        m = OBJ_RE.match(urlsplit(self.path).path)
+        name = unquote(m.group(2)) if m else None
+        with srv.lock:
+            srv.deleted.append(name)
+            found = srv.objects.pop(name, None) is not None
+        self._reply(204 if found else 404)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class _Response:
+    def __init__(self, resp):
+        self.status_code = resp.status
+        self.headers = dict(resp.getheaders())
+        self.content = resp.read()
+        self.text = self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _Session:
+    """The subset of requests.Session that gcpup.resumable uses."""
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        if params:
+            path += ("&" if parts.query else "?") + urlencode(params)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        conn = http.client.HTTPConnection(parts.netloc, timeout=timeout)
+        try:
+            conn.request(method, path, body=data, headers=headers or {})
+            return _Response(conn.getresponse())
+        finally:
+            conn.close()
+
+    def post(self, url, **kw):
+        return self.request("POST", url, **kw)
+
+    def put(self, url, **kw):
+        return self.request("PUT", url, **kw)
+
+    def delete(self, url, **kw):
+        return self.request("DELETE", url, **kw)
+
+
+class _SessionStore:
+    """Same interface as UploadLedger's session table, in memory."""
+
+    def __init__(self):
+        self.sessions = {}
+
+    def get_session(self, name):
+        return self.sessions.get(name)
+
+    def save_session(self, name, uri, size, mtime_ns):
+        self.sessions[name] = {"uri": uri, "size": size, "mtime_ns": mtime_ns}
+
+    def drop_session(self, name):
+        self.sessions.pop(name, None)
+
+
+class _GCSTestCase(unittest.TestCase):
+    def setUp(self):
+        srv = self.gcs = ThreadingHTTPServer(("127.0.0.1", 0), _FakeGCS)
+        srv.daemon_threads = True
+        srv.lock = threading.Lock()
+        srv.objects, srv.sessions = {}, {}
+        srv.uploaded, srv.deleted, srv.composed = [], [], []
+        srv.chunk_puts, srv.fail_chunks, srv.fail_compose = 0, set(), False
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        self.endpoint = f"http://127.0.0.1:{srv.server_address[1]}"
+        self.http = _Session()
+        self.dir = Path(tempfile.mkdtemp(prefix="resumable_test_"))
+
+    def tearDown(self):
+        self.gcs.shutdown()
+        self.gcs.server_close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_file(self, size):
+        path = self.dir / "video.ts"
+        path.write_bytes(os.urandom(size))
+        return path
+
+
+class ResumableUploadTest(_GCSTestCase):
+    def test_chunked_upload(self):
+        path = self.make_file(2 * CHUNK_ALIGN + 1000)
+        sent = []
+        obj = upload_resumable(self.http, self.endpoint, BUCKET, "hls/a/video.ts", str(path),
+                               chunk_size=CHUNK_ALIGN, before_chunk=sent.append)
+        self.assertEqual(obj["size"], str(path.stat().st_size))
+        self.assertEqual(self.gcs.objects["hls/a/video.ts"], path.read_bytes())
+        self.assertEqual(sent, [CHUNK_ALIGN, CHUNK_ALIGN, 1000])
+
+    def test_resume_after_failure_skips_acknowledged_chunks(self):
+        path = self.make_file(3 * CHUNK_ALIGN)
+        store = _SessionStore()
+        self.gcs.fail_chunks = {2}
+        with self.assertRaises(ResumableUploadError) as cm:
+            upload_resumable(self.http, self.endpoint, BUCKET, "hls/a/video.ts", str(path),
+                             chunk_size=CHUNK_ALIGN, store=store)
+        self.assertEqual(cm.exception.code, 503)
+        self.assertIn("hls/a/video.ts", store.sessions)
+
+        sent = []
+        upload_resumable(self.http, self.endpoint, BUCKET, "hls/a/video.ts", str(path),
+                         chunk_size=CHUNK_ALIGN, store=store, before_chunk=sent.append)
+        self.assertEqual(sent, [CHUNK_ALIGN, CHUNK_ALIGN])  # the first chunk is not re-sent
+        self.assertEqual(len(self.gcs.sessions), 1)
+        self.assertEqual(self.gcs.objects["hls/a/video.ts"], path.read_bytes())
+        self.assertEqual(store.sessions, {})
+
+
+class CompositeUploadTest(_GCSTestCase):
+    def test_parts_live_under_tmp_prefix_and_are_removed(self):
+        path = self.make_file(3 * CHUNK_ALIGN + 100)
+        scheduled = []
+
+        def run_part(nbytes, fn):
+            scheduled.append(nbytes)
+            return fn()
+
+        obj = upload_composite(self.http, self.endpoint, BUCKET, "hls/a/video.ts", str(path),
+                               parts=4, max_workers=4, run_part=run_part)
+        self.assertEqual(obj["name"], "hls/a/video.ts")
+        self.assertEqual(self.gcs.objects, {"hls/a/video.ts": path.read_bytes()})
+
+        parts = [n for n in self.gcs.uploaded if n != "hls/a/video.ts"]
+        self.assertEqual(len(parts), 4)
+        self.assertTrue(all(n.startswith(COMPOSE_TMP_PREFIX + "hls/a/video.ts.part") for n in parts))
+        self.assertEqual(self.gcs.composed, [sorted(parts)])
+        self.assertEqual(sorted(self.gcs.deleted), sorted(parts))
+        # every part plus the compose call went through the scheduler
+        self.assertEqual(sorted(scheduled), [0, 100, CHUNK_ALIGN, CHUNK_ALIGN, CHUNK_ALIGN])
+
+    def test_parts_removed_when_compose_fails(self):
+        path = self.make_file(2 * CHUNK_ALIGN)
+        self.gcs.fail_compose = True
+        with self.assertRaises(ResumableUploadError):
+            upload_composite(self.http, self.endpoint, BUCKET, "hls/a/video.ts", str(path),
+                             parts=2, part_prefix="_tmp/x/")
+        self.assertEqual(self.gcs.objects, {})
+        self.assertTrue(self.gcs.deleted)
+        self.assertTrue(all(n.startswith("_tmp/x/") for n in self.gcs.deleted))
+
+
+if __name__ == "__main__":
+    unittest.main()